@@ -28,9 +28,11 @@ class Directive(object):
     All subtypes must implement <function nextaddress> with two parameters, 
     and may implement <function nextaddresses> with two parameters. This allows
     for them to be called the same way, even if they implement the method in a 
-    different way.
+    different way. As with instructions, subtypes must declare __slots__.
     """
 
+    __slots__ = ("args",)
+
     def __init__(self, args):
         self.args = args
 
@@ -60,30 +62,119 @@ class Directive(object):
         
         Returns an empty string because directives that do not have a 
         manifestation such as .text can choose not to implement encode
-        functionality, and instead inherit this. 
+        functionality, and instead inherit this. Directives that do insert
+        data implement pack, and their encoding is the hex of what it packs.
         """
-        return ""
+        packed = self.pack()
+        if not packed:
+            return ""
+        return [binascii.hexlify(data) for data in packed]
 
-    def encodef(self, formatstring):
+    def encodeblock(self, curraddr):
+        """
+        Returns all lines of output of this directive placed at curraddr.
+
+        The lines are joined into one string, without a trailing newline, 
+        and the string is empty if the directive has no encoding. 
+        """
+        encoding = self.encode()
+        if not encoding:
+            return ""
+        addresses = self.nextaddresses(curraddr)
+        return "\n".join(["%08x: %s" % line for line in zip(addresses, encoding)])
+
+    def pack(self):
+        """ 
+        Returns the raw bytes of each data item as a list of strings. 
+
+        Directives without a manifestation in memory inherit this and pack
+        nothing. 
+        """
+        return []
+
+    def packblock(self):
+        """
+        Returns the raw bytes of all data items as one string.
+
+        Items are placed one after the other, so this is the memory the 
+        directive fills, starting at its address.
+        """
+        return "".join(self.pack())
+
+    def reservedsize(self, curraddr):
+        """
+        Returns the number of bytes reserved from curraddr without data.
+
+        Only directives that set aside memory, such as .space, reserve any;
+        directives that move to another address do not.
+        """
+        return 0
+
+    def parsevalues(self, formatstring):
+        """
+        Parses every argument as a value of formatstring at once.
+
+        Integers may be given in hex with a 0x prefix. Arguments left with a
+        stray comma by the split in dlxparser.directivehandler are stripped 
+        of it, but only if the list fails to parse as it is. 
+        """
+        args = self.args
+        for attempt in range(2):
+            try:
+                if 'i' not in formatstring:
+                    return map(float, args)
+                if '0x' not in "".join(args):
+                    return map(int, args)
+                return map(parseinteger, args)
+            except ValueError:
+                if attempt:
+                    raise
+                args = [val.strip(', ') for val in args]
+
+    def packblockf(self, formatstring):
+        """ 
+        Packs every argument as a value of formatstring in one string. 
+
+        All values are converted by a single call to struct.pack, with the
+        format repeated once per value. 
+        """
+        values = self.parsevalues(formatstring)
+        bulkformat = formatstring[0] + str(len(values)) + formatstring[1:]
+        return struct.pack(bulkformat, *values)
+
+    def packf(self, formatstring):
         """ 
-        Base encoding functionality for data inserting directives. 
+        Base packing functionality for data inserting directives. 
         
         Each subclasses may make a call to this with different parameters 
         depending on how they need to be formatted, e.g. as decimal, hex, etc. 
         """
-        encoding = []
-        for val in self.args:    
-            val = val.strip(', ')
-            if 'i' in formatstring:
-                if '0x' in val:
-                    val = int(val, 16)
-                else: 
-                    val = int(val)
-            else:
-                val = float(val)
-            asstring = binascii.hexlify(struct.pack(formatstring, val))
-            encoding.append(asstring)
-        return encoding
+        block = self.packblockf(formatstring)
+        size = struct.calcsize(formatstring)
+        return [block[start:start + size] for start in xrange(0, len(block), size)]
+
+    def encodef(self, formatstring):
+        """ Returns the hex of every value of formatstring, from one hexlify. """
+        hexblock = binascii.hexlify(self.packblockf(formatstring))
+        width = 2 * struct.calcsize(formatstring)
+        return [hexblock[start:start + width] 
+                for start in xrange(0, len(hexblock), width)]
+
+    def encodeblockf(self, formatstring, curraddr):
+        """
+        Returns the output of values of formatstring placed at curraddr.
+
+        The same as encodeblock, but the lines of all values are formatted by
+        a single string operation. 
+        """
+        encoding = self.encodef(formatstring)
+        if not encoding:
+            return ""
+        size = struct.calcsize(formatstring)
+        fields = [None] * (2 * len(encoding))
+        fields[0::2] = xrange(curraddr, curraddr + size * len(encoding), size)
+        fields[1::2] = encoding
+        return ("%08x: %s\n" * len(encoding) % tuple(fields))[:-1]
 
 class TextDirective(Directive):
     """
@@ -94,6 +185,8 @@ class TextDirective(Directive):
     next instruction is set to 0. 
     """
 
+    __slots__ = ()
+
     def nextaddress(self, curraddr):
         if self.args:
             return int(self.args[0], 16)
@@ -108,6 +201,8 @@ class DataDirective(Directive):
     item will be set to 0x200.
     """
 
+    __slots__ = ()
+
     def nextaddress(self, curraddr):
         if self.args:
             return int(self.args[0], 16)
@@ -122,12 +217,17 @@ class AlignDirective(Directive):
     not change the address if it is already at that address. 
     """
 
+    __slots__ = ()
+
     def nextaddress(self, curraddr):
         multof = pow(2, int(self.args[0]))
         if curraddr % multof == 0:
             return curraddr
         return (int(curraddr)/multof)*multof+multof
 
+    def reservedsize(self, curraddr):
+        return self.nextaddress(curraddr) - curraddr
+
 class AsciizDirective(Directive):
     """
     Implements functionality for the .asciiz directive. 
@@ -136,12 +236,11 @@ class AsciizDirective(Directive):
     tokens that each contain a string. 
     """
 
+    __slots__ = ()
+
     def nextaddress(self, curraddr):
         """ Increments address by the total length of all given strings. """ 
-        bytelength = 0
-        for asciiword in self.args:
-            bytelength = bytelength + len(asciiword.strip('"')) + 1
-        return bytelength + curraddr
+        return curraddr + len(self.packblock())
 
     def nextaddresses(self, curraddr):
         """ Gives a list of address on which each string will be inserted. """ 
@@ -152,20 +251,43 @@ class AsciizDirective(Directive):
             curraddr = curraddr + wordlen
         return addresses
 
-    def encode(self):
+    def pack(self):
         """
-        Provides an encoding for this directive. 
+        Provides the bytes of this directive. 
 
-        Returns a list of encodings, each of which corresponds to a string. 
+        Returns a list of byte strings, each of which corresponds to a string. 
         Multiple individual arguments correspond to multiple lines of encoding. 
         However, multiple words in an argument all go on the same line. Null 
         terminator is added to the end of each string. 
         """
-        encoding = []
-        for asciiword in self.args:
-            asciiword = asciiword.strip('"')    
-            encoding.append((asciiword + '\0').encode('hex'))
-        return encoding
+        return [asciiword.strip('"') + '\0' for asciiword in self.args]
+
+    def packblock(self):
+        """ Returns all strings, each null terminated, as one string. """
+        return "\0".join([asciiword.strip('"') for asciiword in self.args] 
+                         + [""])
+
+    def encodeblock(self, curraddr):
+        """
+        Returns the output of the strings placed at curraddr.
+
+        All strings are hexlified as one block, which is cut at the end of 
+        each string, and the lines are formatted by a single string 
+        operation, as for the other data directives. 
+        """
+        packed = self.pack()
+        if not packed:
+            return ""
+        hexblock = binascii.hexlify("".join(packed))
+        fields = []
+        start = 0
+        for data in packed:
+            end = start + 2 * len(data)
+            fields.append(curraddr)
+            fields.append(hexblock[start:end])
+            curraddr = curraddr + len(data)
+            start = end
+        return ("%08x: %s\n" * len(packed) % tuple(fields))[:-1]
 
 class DoubleDirective(Directive):
     """
@@ -174,15 +296,26 @@ class DoubleDirective(Directive):
     Stores given doubles in memory. Must have n>0 argument tokens. 
     """
 
+    __slots__ = ()
+
     def nextaddress(self, curraddr):
         return super(DoubleDirective, self).nextaddress(curraddr, 8)
 
     def nextaddresses(self, curraddr):
         return super(DoubleDirective, self).nextaddresses(curraddr, 8)
 
+    def pack(self):
+        return super(DoubleDirective, self).packf('>d')
+
+    def packblock(self):
+        return super(DoubleDirective, self).packblockf('>d')
+
     def encode(self):
         return super(DoubleDirective, self).encodef('>d')
 
+    def encodeblock(self, curraddr):
+        return super(DoubleDirective, self).encodeblockf('>d', curraddr)
+
 class FloatDirective(Directive):
     """
     Implements functionality for the .float directive. 
@@ -190,9 +323,20 @@ class FloatDirective(Directive):
     Stores given floats in memory. Must have n>0 argument tokens. 
     """
 
+    __slots__ = ()
+
+    def pack(self):
+        return super(FloatDirective, self).packf('>f')
+
+    def packblock(self):
+        return super(FloatDirective, self).packblockf('>f')
+
     def encode(self):
         return super(FloatDirective, self).encodef('>f')
 
+    def encodeblock(self, curraddr):
+        return super(FloatDirective, self).encodeblockf('>f', curraddr)
+
     def nextaddress(self, curraddr):
         return super(FloatDirective, self).nextaddress(curraddr, 4)
 
@@ -206,9 +350,20 @@ class WordDirective(Directive):
     Stores given integers in memory. Must have n>0 argument tokens. 
     """
 
+    __slots__ = ()
+
+    def pack(self):
+        return super(WordDirective, self).packf('>i')
+
+    def packblock(self):
+        return super(WordDirective, self).packblockf('>i')
+
     def encode(self):
         return super(WordDirective, self).encodef('>i')
 
+    def encodeblock(self, curraddr):
+        return super(WordDirective, self).encodeblockf('>i', curraddr)
+
     def nextaddresses(self, curraddr):
         return super(WordDirective, self).nextaddresses(curraddr, 4)
 
@@ -221,9 +376,39 @@ class SpaceDirective(Directive):
 
     Increments address by amount given in n. Arguments must contain >0 tokens. 
     """
+
+    __slots__ = ()
     
     def nextaddress(self, curraddr):
-        return curraddr + int(self.args[0])
+        return curraddr + parseinteger(self.args[0])
+
+    def reservedsize(self, curraddr):
+        return parseinteger(self.args[0])
+
+class IncludeDirective(Directive):
+    """
+    Implements functionality for the .include directive.
+
+    Stands for the lines of the file named by its only argument, a quoted 
+    path relative to the file holding the directive. The Assembler puts the
+    line objects of that file in its place, so the directive itself neither
+    moves the address nor has an encoding. 
+    """
+
+    __slots__ = ()
+
+    def nextaddress(self, curraddr):
+        return curraddr
+
+    def path(self):
+        """ Returns the path of the included file, as written. """
+        return self.args[0].strip('"')
+
+def parseinteger(token):
+    """ Parses an integer argument, in hex if it has a 0x prefix. """
+    if '0x' in token:
+        return int(token, 16)
+    return int(token)
 
 DIRECTIVES = {} 
 def mapdirectives():
@@ -236,4 +421,5 @@ def mapdirectives():
     DIRECTIVES[".float"] = FloatDirective
     DIRECTIVES[".word"] = WordDirective
     DIRECTIVES[".space"] = SpaceDirective
+    DIRECTIVES[".include"] = IncludeDirective
 mapdirectives()
@@ -2,33 +2,431 @@
 DLX Assembler
 ========
 
-This module handles user input and file IO. 
-User input is validated first. Then, input file is opened and read, its contents
-being passed to dlxparser for further processing.
+This module handles user input and file IO.
+User input is validated first. Then, input file is opened and mapped into memory,
+its contents being passed to dlxparser for further processing.
 
+Many files can be assembled by one invocation. Directories are searched for
+.dlx files and a manifest can list further inputs, one path per line. Batches
+are spread over a pool of worker processes, one per core by default. Each
+worker reads, assembles and writes its own files, so the I/O of one file
+overlaps with the encoding of others.
+
+With --cache, output is kept in a content addressed cache (see dlxcache) and 
+inputs that were assembled before are copied from it instead.
+
+With --stats, a single input is assembled by dlxstats instead, which writes
+timings and counts of the assembly as JSON.
+
+With --parallel, both passes of a single input are spread over the worker
+processes instead (see dlxparallel).
+
+With --watch, a single input is assembled again every time it or a file it
+includes changes, until interrupted (see dlxwatch).
+
+With --map, a source map from addresses to source lines is written next to
+the output of every input (see dlxmap).
+
+With --check, the inputs are only checked for errors, all of which are
+written as JSON with their file and line (see dlxcheck).
 """
 
-import sys, os
-import dlxparser
+import sys, os, json, mmap, argparse, multiprocessing, contextlib
+import dlxparser, dlximage, dlxsegments, dlxobject, dlxcache
+import dlxparallel
 
-def main():
-    """ Main function. Checks arguments and begins execution. """
-    args = sys.argv
-    if args[1]:
-        filepath, extension = os.path.splitext(args[1])
-        if extension != ".dlx":
-            sys.exit("Please supply a valid .dlx file")
-    else: 
-        sys.exit("Please provide an input file.")
-
-    try: 
-        with open(args[1], "r") as infile:
+# Buffer size for the output file when streaming.
+WRITEBUFFER = 1 << 20
+
+def parseargs(argv):
+    """ Parses command line arguments. """
+    parser = argparse.ArgumentParser(description="Assembles DLX programs.")
+    parser.add_argument("inputfiles", nargs="*", metavar="inputfile",
+        help="a .dlx file to assemble, or a directory of them")
+    parser.add_argument("--manifest", action="append", default=[],
+        help="a file listing further inputs, one per line")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+        help="number of worker processes (default: one per core)")
+    parser.add_argument("--stream", action="store_true",
+        help="stream the input and output instead of holding them in memory")
+    parser.add_argument("--format", choices=["hex", "bin", "seg", "obj"],
+        default="hex", help="write a .hex listing (default), a .bin big-endian "
+            "memory image, a .seg sparse segment map or a relocatable .obj "
+            "object for dlxlink.py")
+    parser.add_argument("--parallel", action="store_true",
+        help="assemble a single input on the worker processes")
+    parser.add_argument("--watch", action="store_true",
+        help="assemble a single input again whenever it changes")
+    parser.add_argument("--vector", action="store_true",
+        help="encode instructions in bulk with NumPy")
+    parser.add_argument("--map", action="store_true",
+        help="also write a .map from addresses to source lines")
+    parser.add_argument("--cache", nargs="?", const=dlxcache.DEFAULTDIR,
+        metavar="DIR", help="reuse output cached in DIR (default: {0})".format(
+            dlxcache.DEFAULTDIR))
+    parser.add_argument("--cache-size", type=int, default=dlxcache.DEFAULTSIZE,
+        metavar="BYTES", help="evict cached output beyond this size")
+    parser.add_argument("--cache-stats", action="store_true",
+        help="print the hit and miss counts of the cache")
+    parser.add_argument("--stats", nargs="?", const="-", metavar="FILE",
+        help="write statistics of the assembly as JSON to FILE (default: "
+            "standard output)")
+    parser.add_argument("--check", action="store_true",
+        help="only check the inputs, writing every error as JSON to "
+            "standard output")
+    args = parser.parse_args(argv)
+    if not args.inputfiles and not args.manifest:
+        parser.error("Please provide an input file.")
+    if args.stats is not None and (args.stream or args.manifest
+            or len(args.inputfiles) != 1 or os.path.isdir(args.inputfiles[0])):
+        parser.error("--stats takes a single input file and no --stream")
+    if args.vector:
+        import dlxvector # Loads NumPy, so only when asked for
+        if not dlxvector.AVAILABLE:
+            parser.error("--vector requires NumPy")
+    if args.vector and args.format in ("seg", "obj"):
+        parser.error("--vector does not apply to --format " + args.format)
+    if args.stats is not None and args.format == "obj":
+        parser.error("--stats does not apply to --format obj")
+    if args.parallel and (args.manifest or len(args.inputfiles) != 1
+            or os.path.isdir(args.inputfiles[0])):
+        parser.error("--parallel takes a single input file")
+    if args.parallel and (args.stream or args.vector or args.stats is not None
+            or args.format != "hex"):
+        parser.error("--parallel applies only to --format hex, without "
+            "--stream, --vector or --stats")
+    if args.watch and (args.manifest or len(args.inputfiles) != 1
+            or os.path.isdir(args.inputfiles[0])):
+        parser.error("--watch takes a single input file")
+    if args.watch and (args.stream or args.vector or args.parallel
+            or args.stats is not None or args.cache is not None
+            or args.format != "hex"):
+        parser.error("--watch applies only to --format hex, without "
+            "--stream, --vector, --parallel, --stats or --cache")
+    if args.map and (args.format == "obj" or args.watch
+            or args.stats is not None):
+        parser.error("--map does not apply to --format obj, --watch or "
+            "--stats")
+    if args.check and (args.stats is not None or args.watch
+            or args.parallel or args.map):
+        parser.error("--check does not assemble, so takes no --stats, "
+            "--watch, --parallel or --map")
+    return args
+
+def findinputs(args):
+    """
+    Returns the list of input files named by the arguments.
+
+    Directories are searched recursively for .dlx files, manifests are read
+    for one input per line, ignoring blank lines and ';' comments.
+    """
+    inputs = list(args.inputfiles)
+    for manifest in args.manifest:
+        basedir = os.path.dirname(manifest)
+        with open(manifest, "r") as manifestfile:
+            for line in manifestfile:
+                entry = line.partition(";")[0].strip()
+                if entry:
+                    inputs.append(os.path.join(basedir, entry))
+    inputfiles = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for dirpath, dirnames, filenames in os.walk(entry):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.endswith(".dlx"):
+                        inputfiles.append(os.path.join(dirpath, filename))
+        else:
+            inputfiles.append(entry)
+    return inputfiles
+
+def makecache(args):
+    """ Returns the output cache asked for by args, or None. """
+    if args.cache is None:
+        return None
+    return dlxcache.Cache(args.cache, args.cache_size)
+
+def includedir(inputfile):
+    """ Returns the directory files included by inputfile are found in. """
+    return os.path.dirname(inputfile) or os.curdir
+
+def assemblefile(inputfile, args, cache=None):
+    """ 
+    Assembles one input file to the output file given by args. 
+
+    If a cache is given, the output is copied from it when possible and 
+    stored in it otherwise.
+    """
+    filepath, extension = os.path.splitext(inputfile)
+    if extension != ".dlx":
+        raise ValueError("Please supply a valid .dlx file")
+    if args.vector:
+        import dlxvector
+    outputpath = filepath + "." + args.format
+    if args.map:
+        writemap(inputfile, filepath + ".map", cache)
+    key = cachekey(cache, inputfile, args.format)
+    if key is not None and cache.fetch(key, outputpath):
+        return
+    if args.format == "bin":
+        assemblebinary(inputfile, args, outputpath)
+    elif args.format == "seg":
+        assemblesegments(inputfile, args, outputpath)
+    elif args.format == "obj":
+        with mapinput(inputfile) as inputdata:
+            outputdata = dlxobject.run(inputdata, includedir(inputfile))
+        with open(outputpath, "w") as outfile:
+            outfile.write(outputdata)
+    elif args.stream:
+        stream = dlxvector.stream if args.vector else dlxparser.stream
+        with open(inputfile, "r") as infile:
+            with open(outputpath, "w", WRITEBUFFER) as outfile:
+                stream(infile, outfile, includedir(inputfile))
+    elif args.parallel:
+        with open(inputfile, "r") as infile:
             inputdata = infile.read()
-        outputdata = dlxparser.run(inputdata)
-        with open(filepath + ".hex", "w") as outfile:
+        outputdata = dlxparallel.run(inputdata, args.jobs,
+                                     includedir(inputfile))
+        with open(outputpath, "w") as outfile:
+            outfile.write(outputdata)
+    else:
+        with mapinput(inputfile) as inputdata:
+            if args.vector:
+                outputdata = dlxvector.run(inputdata, includedir(inputfile))
+            else:
+                outputdata = dlxparser.run(inputdata, includedir(inputfile))
+        with open(outputpath, "w") as outfile:
             outfile.write(outputdata)
+    if key is not None:
+        cache.store(key, outputpath)
+
+def cachekey(cache, inputfile, outputformat):
+    """
+    Returns the key of the output in cache, or None if there is no cache.
+
+    The key covers the files the input includes, which are found before the
+    input is parsed. If one cannot be read the input is not cached, so that
+    assembly reports the first error of the program, which may come before
+    the include.
+    """
+    if cache is None:
+        return None
+    try:
+        return cache.key(inputfile, outputformat)
+    except IOError:
+        return None
+
+def writemap(inputfile, mappath, cache=None):
+    """
+    Writes the source map of inputfile to mappath.
+
+    If a cache is given, the map is kept in it like output, under a key of
+    its own, and only built if it is not there. Maps are not counted as hits
+    or misses.
+    """
+    import dlxmap
+    key = cachekey(cache, inputfile, "map")
+    if key is not None and cache.fetch(key, mappath, False):
+        return
+    dlxmap.save(mappath, dlxmap.build(inputfile, includedir(inputfile)))
+    if key is not None:
+        cache.store(key, mappath)
+
+@contextlib.contextmanager
+def mapinput(inputfile):
+    """
+    Maps the contents of inputfile into memory for the duration of a block.
+
+    The parser scans the map in place (see dlxparser.lex), so the input is
+    never read into a string of its own. An empty file, which cannot be 
+    mapped, gives an empty string.
+    """
+    with open(inputfile, "r") as infile:
+        if os.fstat(infile.fileno()).st_size == 0:
+            yield ""
+            return
+        inputdata = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield inputdata
+    finally:
+        inputdata.close()
+
+def assemblestats(inputfile, args):
+    """ Assembles one input file like assemblefile and writes its stats. """
+    import dlxstats
+    filepath, extension = os.path.splitext(inputfile)
+    if extension != ".dlx":
+        raise ValueError("Please supply a valid .dlx file")
+    outputpath = filepath + "." + args.format
+    stats = dlxstats.assemble(inputfile, outputpath, args.format, args.vector,
+                              includedir(inputfile))
+    writejson(stats, args.stats)
+
+def checkfiles(inputfiles):
+    """
+    Checks every input file for errors and writes them as JSON.
+
+    Returns whether any were found.
+    """
+    import dlxcheck
+    diagnostics = []
+    for inputfile in inputfiles:
+        if os.path.splitext(inputfile)[1] != ".dlx":
+            diagnostics.append((inputfile, None,
+                                "Please supply a valid .dlx file"))
+        else:
+            diagnostics.extend(dlxcheck.check(inputfile,
+                                              includedir(inputfile)))
+    errors = [{"file": path, "line": lineno, "message": message}
+              for path, lineno, message in diagnostics]
+    writejson({"files": len(inputfiles), "errors": errors}, "-")
+    return bool(errors)
+
+def writejson(data, path):
+    """ Writes data as JSON to the file at path, or standard output if "-". """
+    if path == "-":
+        json.dump(data, sys.stdout, indent=2, separators=(",", ": "),
+                  sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(path, "w") as jsonfile:
+            json.dump(data, jsonfile, indent=2, separators=(",", ": "),
+                      sort_keys=True)
+
+def assemblebinary(inputfile, args, outputpath):
+    """ Assembles the input file to a binary memory image at outputpath. """
+    if args.vector:
+        import dlxvector
+    if args.stream:
+        with open(inputfile, "r") as infile:
+            if args.vector:
+                dlxvector.streamimage(infile, outputpath, includedir(inputfile))
+            else:
+                dlximage.stream(infile, outputpath, includedir(inputfile))
+    else:
+        assembler = dlxparser.Assembler(includedir(inputfile))
+        with mapinput(inputfile) as inputdata:
+            instructionlist = assembler.firstpass(inputdata)
+        instructionlist = assembler.resolveall(instructionlist)
+        size = dlximage.imagesize(instructionlist)
+        placer = dlxvector.place if args.vector else dlximage.place
+        dlximage.write(assembler, instructionlist, size, outputpath, placer)
+
+def assemblesegments(inputfile, args, outputpath):
+    """ Assembles the input file to a sparse segment map at outputpath. """
+    if args.stream:
+        with open(inputfile, "r") as infile:
+            with open(outputpath, "w", WRITEBUFFER) as outfile:
+                dlxsegments.stream(infile, outfile, includedir(inputfile))
+        return
+    with mapinput(inputfile) as inputdata:
+        outputdata = dlxsegments.run(inputdata, includedir(inputfile))
+    with open(outputpath, "w") as outfile:
+        outfile.write(outputdata)
+
+def watchfile(inputfile):
+    """ Assembles one input file again whenever it changes, until interrupted. """
+    import dlxwatch
+    filepath, extension = os.path.splitext(inputfile)
+    if extension != ".dlx":
+        sys.exit("Please supply a valid .dlx file")
+    try:
+        dlxwatch.watch(inputfile, filepath + ".hex", includedir(inputfile))
+    except KeyboardInterrupt:
+        pass
+
+def batchworker(job):
+    """
+    Assembles one file of a batch in a worker process.
+
+    Returns the input file, None or the error message, so that one bad file
+    cannot stop the rest of the batch, and the number of cache hits.
+    """
+    inputfile, args = job
+    cache = makecache(args)
+    try:
+        assemblefile(inputfile, args, cache)
+    except Exception, exc:
+        return inputfile, str(exc), 0
+    return inputfile, None, cache.hits if cache else 0
+
+def assemblebatch(inputfiles, args, cache):
+    """ 
+    Assembles every input file across a process pool. Returns failures. 
+
+    Cache hits and misses of the workers are added to cache.
+    """
+    jobs = args.jobs or multiprocessing.cpu_count()
+    jobs = min(jobs, len(inputfiles))
+    work = [(inputfile, args) for inputfile in inputfiles]
+    if jobs <= 1:
+        results = map(batchworker, work)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            chunksize = max(1, len(work) // (jobs * 4))
+            results = list(pool.imap_unordered(batchworker, work, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    failures = []
+    for inputfile, error, hits in results:
+        if error is not None:
+            sys.stderr.write("{0}: {1}\n".format(inputfile, error))
+            failures.append(inputfile)
+        elif cache is not None:
+            cache.hits = cache.hits + hits
+            cache.misses = cache.misses + 1 - hits
+    return failures
+
+def reportcache(cache, args):
+    """ Saves the cache statistics and prints them if asked to. """
+    if cache is None:
+        return
+    hits, misses = cache.hits, cache.misses
+    cache.savestats()
+    if args.cache_stats:
+        saved = cache.stats()
+        print "cache: {0} hits, {1} misses (total {2} hits, {3} misses)".format(
+            hits, misses, saved["hits"], saved["misses"])
+
+def main():
+    """ Main function. Checks arguments and begins execution. """
+    args = parseargs(sys.argv[1:])
+    if args.watch:
+        watchfile(args.inputfiles[0])
+        return
+    if args.check:
+        if checkfiles(findinputs(args)):
+            sys.exit(1)
+        return
+    if args.stats is not None:
+        try:
+            assemblestats(args.inputfiles[0], args)
+        except (IOError, ValueError), exc:
+            sys.exit(str(exc))
+        return
+    cache = makecache(args)
+    if (len(args.inputfiles) == 1 and not args.manifest
+            and not os.path.isdir(args.inputfiles[0])):
+        try:
+            assemblefile(args.inputfiles[0], args, cache)
+        except (IOError, ValueError), exc:
+            sys.exit(str(exc))
+        reportcache(cache, args)
+        return
+
+    try:
+        inputfiles = findinputs(args)
     except IOError, exc:
         sys.exit(str(exc))
+    if not inputfiles:
+        sys.exit("No .dlx files found.")
+    failures = assemblebatch(inputfiles, args, cache)
+    reportcache(cache, args)
+    if failures:
+        sys.exit("{0} of {1} files failed to assemble".format(
+            len(failures), len(inputfiles)))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,263 @@
+"""
+DLX Assembler Benchmark
+=======================
+
+Measures assembler throughput on synthetic programs from dlxgen, which use
+every opcode and every directive but .include, label heavy code with forward
+branches and large data sections.
+
+Usage:
+    python dlxbench.py [lines] [repeats]
+    python dlxbench.py suite [--sizes N [N ...]] [--seed N] [--vector]
+                             [--save-baseline FILE] [--baseline FILE]
+                             [--tolerance FRACTION]
+    python dlxbench.py startup [repeats]
+    python dlxbench.py memory [lines]
+
+Reports the best time of all repeats in lines per second. The startup 
+benchmark instead times loading the opcode tables, from their text files and 
+from their compiled form, and the memory benchmark reports the bytes each line
+of a program takes up after the first pass.
+
+The suite assembles one program of each size, from a thousand lines up to a
+million, more with --sizes, each in a fresh process so that its peak memory
+is its own. It reports the time spent reading the input, in the first pass,
+in the second pass and writing the output, the throughput and the peak
+memory. Results can be saved as a baseline, and a later run checked against
+it fails if any size got slower or bigger than the tolerance allows.
+"""
+
+import sys, os, time, json, argparse, subprocess, tempfile
+import dlxparser, dlxgen
+
+# Program sizes of the suite, and the share by which a size may fall behind
+# its baseline before the suite fails.
+SUITESIZES = [1000, 10000, 100000, 1000000]
+TOLERANCE = 0.2
+
+def generate(numlines, seed=0):
+    """ Returns a synthetic program of numlines lines as a string. """
+    return "\n".join(dlxgen.generate(numlines, seed))
+
+def bench(inputdata, repeats):
+    """ Assembles inputdata repeats times and returns the best time. """
+    assembler = dlxparser.Assembler()
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        assembler.run(inputdata)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchstartup(repeats):
+    """ 
+    Times loading the opcode tables from text and from their compiled form.
+
+    Returns the best time of each, in that order.
+    """
+    import instructions
+    signature = instructions.tablessignature()
+    fromtext = fromcompiled = None
+    for _ in range(repeats):
+        start = time.time()
+        instructions.parsetables()
+        elapsed = time.time() - start
+        if fromtext is None or elapsed < fromtext:
+            fromtext = elapsed
+        start = time.time()
+        instructions.tablessignature()
+        instructions.loadcompiled(signature)
+        elapsed = time.time() - start
+        if fromcompiled is None or elapsed < fromcompiled:
+            fromcompiled = elapsed
+    return fromtext, fromcompiled
+
+def benchmemory(inputdata):
+    """ 
+    Returns the bytes held per line by the first pass of inputdata.
+
+    Counts every line object, its instance dictionary if it has one, and the
+    list holding them. Values shared between lines, such as small integers,
+    are not counted.
+    """
+    instructionlist = dlxparser.Assembler().firstpass(inputdata)
+    total = sys.getsizeof(instructionlist)
+    for lineobj in instructionlist:
+        total = total + sys.getsizeof(lineobj)
+        if hasattr(lineobj, "__dict__"):
+            total = total + sys.getsizeof(lineobj.__dict__)
+    return float(total) / len(instructionlist)
+
+def benchphases(inputpath, vector=False):
+    """
+    Assembles the program at inputpath once, timing every phase.
+
+    Returns the times in seconds of reading the input, the first pass, the
+    second pass and writing the output, and the peak memory of the process
+    in bytes.
+    """
+    import dlxstats
+    assembler = dlxparser.Assembler()
+    handle, outputpath = tempfile.mkstemp(suffix=".hex")
+    try:
+        start = time.time()
+        with open(inputpath, "r") as infile:
+            inputdata = infile.read()
+        afterread = time.time()
+        instructionlist = assembler.firstpass(inputdata)
+        afterfirstpass = time.time()
+        if vector:
+            import dlxvector
+            outputdata = dlxvector.encodetext(assembler, instructionlist)
+        else:
+            outputdata = assembler.secondpass(instructionlist)
+        aftersecondpass = time.time()
+        with os.fdopen(handle, "w") as outfile:
+            outfile.write(outputdata)
+        end = time.time()
+    finally:
+        os.remove(outputpath)
+    return {"read": afterread - start,
+            "firstpass": afterfirstpass - afterread,
+            "secondpass": aftersecondpass - afterfirstpass,
+            "write": end - aftersecondpass,
+            "peak": dlxstats.peakmemory()}
+
+def benchsuite(sizes, seed, vector=False):
+    """
+    Runs benchphases on a program of every size, each in its own process.
+
+    Returns the results keyed by size, with the total time and the throughput
+    in lines per second added.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "dlxbench.py")
+    results = {}
+    for numlines in sizes:
+        handle, inputpath = tempfile.mkstemp(suffix=".dlx")
+        try:
+            with os.fdopen(handle, "w") as infile:
+                for line in dlxgen.generate(numlines, seed):
+                    infile.write(line + "\n")
+            command = [sys.executable, script, "phases", inputpath]
+            if vector:
+                command.append("--vector")
+            result = json.loads(subprocess.check_output(command))
+        finally:
+            os.remove(inputpath)
+        result["total"] = (result["read"] + result["firstpass"]
+                           + result["secondpass"] + result["write"])
+        result["linespersec"] = numlines / result["total"]
+        results[str(numlines)] = result
+    return results
+
+def printsuite(results):
+    """ Prints the results of benchsuite as a table. """
+    print "{0:>9} {1:>8} {2:>9} {3:>10} {4:>8} {5:>10} {6:>8}".format(
+        "lines", "read", "firstpass", "secondpass", "write", "lines/sec",
+        "peak MB")
+    for size in sorted(results, key=int):
+        result = results[size]
+        print "{0:>9} {1:>8.3f} {2:>9.3f} {3:>10.3f} {4:>8.3f} {5:>10.0f} {6:>8.1f}".format(
+            int(size), result["read"], result["firstpass"],
+            result["secondpass"], result["write"], result["linespersec"],
+            result["peak"] / float(1 << 20))
+
+def regressions(results, baseline, tolerance):
+    """
+    Compares suite results with a baseline of earlier results.
+
+    Returns a message for every size whose throughput fell, or whose peak
+    memory grew, by more than the tolerance. Sizes missing from either are
+    not compared.
+    """
+    messages = []
+    for size in sorted(results, key=int):
+        if size not in baseline:
+            continue
+        result, base = results[size], baseline[size]
+        if result["linespersec"] < base["linespersec"] * (1 - tolerance):
+            messages.append("{0} lines: {1:.0f} lines/sec, baseline {2:.0f}".format(
+                size, result["linespersec"], base["linespersec"]))
+        if result["peak"] > base["peak"] * (1 + tolerance):
+            messages.append("{0} lines: peak {1:.1f} MB, baseline {2:.1f} MB".format(
+                size, result["peak"] / float(1 << 20),
+                base["peak"] / float(1 << 20)))
+    return messages
+
+def parsesuiteargs(argv):
+    """ Parses the arguments of the suite benchmark. """
+    parser = argparse.ArgumentParser(prog="dlxbench.py suite",
+        description="Benchmarks the assembler on programs of several sizes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SUITESIZES,
+        metavar="N", help="program sizes in lines (default: {0})".format(
+            " ".join(map(str, SUITESIZES))))
+    parser.add_argument("--seed", type=int, default=0,
+        help="seed of the program generator")
+    parser.add_argument("--vector", action="store_true",
+        help="encode instructions in bulk with NumPy")
+    parser.add_argument("--save-baseline", metavar="FILE",
+        help="save the results as a baseline to FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+        help="fail if the results regressed from the baseline in FILE")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+        metavar="FRACTION", help="regression allowed before failing "
+            "(default: {0})".format(TOLERANCE))
+    return parser.parse_args(argv)
+
+def suite(argv):
+    """ Runs the suite benchmark with command line arguments argv. """
+    args = parsesuiteargs(argv)
+    baseline = None
+    if args.baseline is not None:
+        try:
+            with open(args.baseline, "r") as baselinefile:
+                baseline = json.load(baselinefile)
+        except (IOError, ValueError), exc:
+            sys.exit("Cannot read baseline: {0}".format(exc))
+        if (baseline["seed"], baseline["vector"]) != (args.seed, args.vector):
+            sys.exit("Baseline was measured with seed {0}{1}".format(
+                baseline["seed"], " and --vector" if baseline["vector"] else ""))
+    results = benchsuite(args.sizes, args.seed, args.vector)
+    printsuite(results)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as baselinefile:
+            json.dump({"seed": args.seed, "vector": args.vector,
+                       "results": results}, baselinefile, indent=2,
+                      separators=(",", ": "), sort_keys=True)
+    if baseline is not None:
+        messages = regressions(results, baseline["results"], args.tolerance)
+        for message in messages:
+            sys.stderr.write("regression: {0}\n".format(message))
+        if messages:
+            sys.exit(1)
+
+def main():
+    """ Main function. Generates a program and prints its throughput. """
+    if len(sys.argv) > 1 and sys.argv[1] == "suite":
+        suite(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "phases":
+        # Run by benchsuite for one size
+        print json.dumps(benchphases(sys.argv[2], "--vector" in sys.argv[3:]))
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "startup":
+        repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        fromtext, fromcompiled = benchstartup(repeats)
+        print "opcode tables from text: {0:.1f}us, compiled: {1:.1f}us".format(
+            fromtext * 1e6, fromcompiled * 1e6)
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "memory":
+        numlines = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+        print "{0:.1f} bytes per line".format(benchmemory(generate(numlines)))
+        return
+    numlines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    elapsed = bench(generate(numlines), repeats)
+    print "{0} lines in {1:.3f}s: {2:.0f} lines/sec".format(
+        numlines, elapsed, numlines / elapsed)
+
+if __name__ == "__main__":
+    main()
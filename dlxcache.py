@@ -0,0 +1,223 @@
+"""
+Output Cache
+============
+
+A persistent, content addressed cache of assembler output.
+
+Each entry is keyed by a hash of everything the output depends on: the input
+program and the files it includes, the output format, the contents of the 
+opcode tables, the version of the assembler and the contents of its source
+files. A build that assembles an unchanged program again can then
+copy the output from the cache instead of assembling it.
+
+Entries are plain files in the cache directory, named by their key. They are
+written to a temporary file first and renamed into place, so concurrent
+builds sharing a cache never see a partial entry. Reading an entry refreshes
+its modification time, and when the cache grows past its size limit the
+entries used least recently are evicted. Hit and miss counts are kept in a
+stats file in the cache directory.
+"""
+
+import os, errno, glob, hashlib, json, shutil, tempfile
+import dlxparser, instructions
+
+# Default location and size limit of the cache.
+DEFAULTDIR = os.path.join(os.path.expanduser("~"), ".cache", "dlxas")
+DEFAULTSIZE = 256 << 20
+
+# Size of the blocks input files are hashed in.
+HASHBLOCK = 1 << 16
+
+STATSFILE = "stats.json"
+
+_TABLESDIGEST = []
+def tablesdigest():
+    """ Returns a digest of the opcode tables, computed once per process. """
+    if not _TABLESDIGEST:
+        digest = hashlib.sha256()
+        for path in instructions.TABLEFILES:
+            with open(path, "rb") as table:
+                digest.update(table.read())
+        _TABLESDIGEST.append(digest.hexdigest())
+    return _TABLESDIGEST[0]
+
+# Directory of the assembler's modules.
+SOURCEDIR = os.path.dirname(os.path.abspath(__file__))
+
+_SOURCESDIGEST = []
+def sourcesdigest():
+    """
+    Returns a digest of the assembler's modules, computed once per process.
+
+    Every module of the assembler is covered rather than only those that a
+    given output format uses, which costs some needless misses but can never
+    keep stale output.
+    """
+    if not _SOURCESDIGEST:
+        digest = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(SOURCEDIR, "*.py"))):
+            with open(path, "rb") as source:
+                digest.update(os.path.basename(path) + "\n" + source.read())
+        _SOURCESDIGEST.append(digest.hexdigest())
+    return _SOURCESDIGEST[0]
+
+class Cache(object):
+    """
+    A cache directory holding assembler output.
+
+    Counts its hits and misses so they can be reported and saved with
+    savestats.
+    """
+
+    def __init__(self, directory=DEFAULTDIR, maxsize=DEFAULTSIZE):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        try:
+            os.makedirs(directory)
+        except OSError, exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    def key(self, inputfile, outputformat):
+        """
+        Returns the key of the output for an input file and format.
+
+        Raises IOError if the input or a file it includes cannot be read.
+        """
+        digest = hashlib.sha256()
+        digest.update("dlxas {0}\n".format(dlxparser.VERSION))
+        digest.update("sources {0}\n".format(sourcesdigest()))
+        digest.update("tables {0}\n".format(tablesdigest()))
+        digest.update("format {0}\n".format(outputformat))
+        with open(inputfile, "rb") as infile:
+            for block in iter(lambda: infile.read(HASHBLOCK), ""):
+                digest.update(block)
+        for path in includes(inputfile):
+            digest.update("include {0}\n".format(path))
+            with open(path, "rb") as includefile:
+                for block in iter(lambda: includefile.read(HASHBLOCK), ""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def entrypath(self, key):
+        """ Returns the path of the entry for key. """
+        return os.path.join(self.directory, key)
+
+    def fetch(self, key, outputpath, count=True):
+        """
+        Copies the entry for key to outputpath.
+
+        Returns True on a hit. Returns False on a miss, leaving outputpath
+        untouched. Hits and misses are counted unless count is False.
+        """
+        entrypath = self.entrypath(key)
+        try:
+            shutil.copyfile(entrypath, outputpath)
+            os.utime(entrypath, None)
+        except (IOError, OSError), exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            self.misses = self.misses + count
+            return False
+        self.hits = self.hits + count
+        return True
+
+    def store(self, key, outputpath):
+        """ Stores the file at outputpath as the entry for key. """
+        handle, temppath = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as entryfile:
+                with open(outputpath, "rb") as outfile:
+                    shutil.copyfileobj(outfile, entryfile)
+            os.rename(temppath, self.entrypath(key))
+        except:
+            removequietly(temppath)
+            raise
+        self.evict()
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits. """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.startswith(".") or name == STATSFILE:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue # Evicted by a concurrent build
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total = total + stat.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.maxsize:
+                break
+            removequietly(os.path.join(self.directory, name))
+            total = total - size
+
+    def stats(self):
+        """ Returns the hit and miss counts saved in the cache directory. """
+        try:
+            with open(os.path.join(self.directory, STATSFILE), "r") as statsfile:
+                return json.load(statsfile)
+        except (IOError, ValueError):
+            return {"hits": 0, "misses": 0}
+
+    def savestats(self):
+        """
+        Adds the hits and misses counted so far to the saved counts.
+
+        The counts are replaced atomically, but two builds saving at the same
+        moment can lose one another's counts. They are meant as a guide, not
+        an exact record.
+        """
+        if not self.hits and not self.misses:
+            return
+        saved = self.stats()
+        saved["hits"] = saved.get("hits", 0) + self.hits
+        saved["misses"] = saved.get("misses", 0) + self.misses
+        handle, temppath = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as statsfile:
+                json.dump(saved, statsfile)
+            os.rename(temppath, os.path.join(self.directory, STATSFILE))
+        except:
+            removequietly(temppath)
+            raise
+        self.hits = self.misses = 0
+
+def includes(inputfile, found=None):
+    """
+    Returns the paths of the files inputfile includes, directly or not.
+
+    Each file is listed once, in the order it is first included. If found is
+    given, the paths are added to it as they are found, so that a caller 
+    still has them when a file cannot be read, including that file's own.
+    """
+    if found is None:
+        found = []
+    pending = [os.path.realpath(inputfile)]
+    while pending:
+        path = pending.pop(0)
+        directory = os.path.dirname(path)
+        with open(path, "r") as infile:
+            for line in infile:
+                splitted = dlxparser.splitline(line)
+                if splitted is None or splitted[1] != ".include":
+                    continue
+                directive = dlxparser.linehandler(splitted[1], splitted[2])
+                included = os.path.realpath(os.path.join(directory,
+                                                         directive.path()))
+                if included not in found:
+                    found.append(included)
+                    pending.append(included)
+    return found
+
+def removequietly(path):
+    """ Removes a file, ignoring that it may already be gone. """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,119 @@
+"""
+Check Mode
+==========
+
+Finds every error in a program without assembling it, for the --check flag
+of dlxas.
+
+The assembler stops at the first error it meets and does not say where it
+was. check() instead reads the program line by line, following includes,
+and keeps going past every line that fails, recording its file, line number
+and message. The checks are those of the two passes:
+
+    - every line is parsed into its line object, which rejects registers
+      outside r0-r31 along with any other malformed operand
+    - directives are sized and their values read, which the assembler only
+      does once they are placed
+    - labels are collected, and a label defined twice is reported where it
+      is defined again
+    - once every line is read, each reference to a symbol that was never
+      defined is reported where it is made
+
+Instructions are never encoded and nothing is written, which leaves the
+cost of a check at about that of a first pass. Diagnostics are sorted by
+file, in the order the files were first read, and then by line.
+"""
+
+import os
+import dlxparser
+from directives import Directive
+
+def check(inputfile, basedir=None):
+    """
+    Returns the diagnostics of the program in inputfile.
+
+    Each diagnostic is a tuple of the file, the line number and the message.
+    Files included by inputfile are found relative to basedir, the directory
+    of inputfile by default. An input that cannot be read at all gives a
+    single diagnostic without a line number.
+    """
+    basedir = basedir or os.path.dirname(inputfile) or os.curdir
+    checker = Checker()
+    try:
+        with open(inputfile, "r") as infile:
+            lines = infile.read().splitlines()
+    except IOError, exc:
+        return [(inputfile, None, str(exc))]
+    checker.checklines(inputfile, lines, basedir)
+    checker.checksymbols()
+    order = dict((path, index) for index, path in enumerate(checker.files))
+    return sorted(checker.diagnostics, key=lambda diagnostic: (
+        order[diagnostic[0]], diagnostic[1]))
+
+class Checker(object):
+    """ Collects the diagnostics of a program as its lines are checked. """
+
+    def __init__(self):
+        self.diagnostics = []
+        self.symbols = set()
+        self.references = [] # Symbol, file and line of every reference
+        self.including = [] # Files being included, innermost last
+        self.files = [] # Files checked, in the order they were first read
+
+    def checklines(self, path, lines, directory):
+        """
+        Checks the lines of the file at path.
+
+        Files it includes are found relative to directory.
+        """
+        if path not in self.files:
+            self.files.append(path)
+        for lineno, line in enumerate(lines, 1):
+            try:
+                splitted = dlxparser.splitline(line)
+                if splitted is None: # Line was a comment
+                    continue
+                label, token1, operands = splitted
+                if label is not None:
+                    self.definelabel(label, path, lineno)
+                lineobj = dlxparser.linehandler(token1, operands)
+                if token1 == ".include":
+                    self.include(os.path.join(directory, lineobj.path()))
+                elif isinstance(lineobj, Directive):
+                    # Directives only read their arguments when placed
+                    lineobj.nextaddress(0)
+                    lineobj.packblock()
+                else:
+                    symbol = dlxparser.symbolof(lineobj)
+                    if symbol is not None:
+                        self.references.append((symbol, path, lineno))
+            except Exception, exc:
+                self.diagnostics.append((path, lineno, str(exc)))
+
+    def include(self, path):
+        """ Checks the lines of the included file at path. """
+        realpath = os.path.realpath(path)
+        if realpath in self.including:
+            raise Exception("Recursive include: " + realpath)
+        with open(path, "r") as includefile:
+            lines = includefile.read().splitlines()
+        self.including.append(realpath)
+        try:
+            self.checklines(os.path.normpath(path), lines,
+                            os.path.dirname(realpath))
+        finally:
+            self.including.pop()
+
+    def definelabel(self, label, path, lineno):
+        """ Stores a label, reporting it if it was defined before. """
+        if label in self.symbols:
+            self.diagnostics.append((path, lineno,
+                                     "Duplicate symbol: " + label))
+        self.symbols.add(label)
+
+    def checksymbols(self):
+        """ Reports every reference to a symbol that was never defined. """
+        for symbol, path, lineno in self.references:
+            if symbol not in self.symbols:
+                self.diagnostics.append((path, lineno,
+                                         "Undefined symbol: " + symbol))
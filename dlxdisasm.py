@@ -0,0 +1,252 @@
+"""
+DLX Disassembler
+================
+
+Decodes assembled words back into DLX source, to verify assembler output.
+
+Decoding is driven by a table built once from the opcode tables: every entry
+is the text template of one instruction, chosen by the operand grammar
+dlxparser parses it with, and the mask of the bits its encoding leaves zero.
+The 6 bit opcode selects the entry directly, except for opcodes 0 and 1,
+where the function code selects among the R-types. A word whose entry is
+missing, or which sets a bit its entry leaves zero, is not the encoding of
+any instruction and becomes a .word instead. Every line of the listing thus
+assembles back to exactly the word it came from:
+
+    addi r1, r0, -3           ; 00000000: 2001fffd
+
+Branch and jump targets are written as absolute addresses, and .text starts
+every run of words that does not follow on from the one before. Output lines
+of data directives that are not a single word are listed as comments only.
+
+Input is a .hex listing or a .bin memory image. With NumPy, the fields of all
+words are extracted at once and only the text is formatted word by word.
+check() assembles the listing again with dlxparser and compares the result
+with the input, which validates assembler and disassembler against each
+other.
+
+Usage:
+    python dlxdisasm.py [-o output] [--vector] [--check] program.hex|program.bin
+"""
+
+import sys, os, argparse, array
+import dlxparser, instructions
+from instructions import I_OPCODES, J_OPCODES, R_OPCODES, R_FUNCCODES
+from instructions import INSTRUCTIONS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Operand templates by grammar. Fields are numbered as in fields(): 0 the
+# rs1 field, 1 the rdest field of I-types (rs2 of R-types), 2 the rdest
+# field of R-types, 3 the signed immediate, 4 the branch target, 5 the jump
+# target and 6 the signed word.
+TEMPLATES = {
+    dlxparser.NOOPERANDS: "",
+    dlxparser.RTYPEOPERANDS: " r{2}, r{0}, r{1}",
+    dlxparser.ITYPEOPERANDS: " r{1}, r{0}, {3}",
+    dlxparser.LOADOPERANDS: " r{1}, {3}(r{0})",
+    dlxparser.STOREOPERANDS: " {3}(r{0}), r{1}",
+    dlxparser.BRANCHOPERANDS: " r{0}, {4:#x}",
+    dlxparser.REGISTEROPERANDS: " r{0}",
+}
+WORDTEMPLATE = ".word {6}"
+
+# Bits of a word that are zero in every encoding of a grammar.
+ZEROBITS = {
+    dlxparser.BRANCHOPERANDS: 0x001f0000,
+    dlxparser.REGISTEROPERANDS: 0x001fffff,
+}
+RALUZEROBITS = 0x000007c0
+RFPUZEROBITS = 0x000007e0
+
+# Decode table, indexed by key(): the template and zero bits of every entry.
+DECODE = [None] * 192
+
+def builddecode():
+    """ Fills DECODE by inverting the opcode tables. """
+    for mnemonic, opcode in I_OPCODES.items():
+        grammar = dlxparser.OPERANDS[mnemonic]
+        if INSTRUCTIONS.get(mnemonic) is instructions.Trap:
+            DECODE[opcode] = (mnemonic + " {3}", 0x03ff0000)
+        else:
+            DECODE[opcode] = (mnemonic + TEMPLATES[grammar],
+                              ZEROBITS.get(grammar, 0))
+    for mnemonic, opcode in J_OPCODES.items():
+        DECODE[opcode] = (mnemonic + " {5:#x}", 0)
+    for mnemonic, opcode in R_OPCODES.items():
+        func = R_FUNCCODES[mnemonic]
+        zerobits = RALUZEROBITS if opcode == 0 else RFPUZEROBITS
+        if mnemonic == "nop":
+            zerobits = 0x03ffffc0
+        DECODE[64 * (opcode + 1) + func] = (
+            mnemonic + TEMPLATES[dlxparser.OPERANDS[mnemonic]], zerobits)
+builddecode()
+
+FORMATTERS = [entry and entry[0].format for entry in DECODE]
+ZEROMASKS = [entry[1] if entry else 0xffffffff for entry in DECODE]
+
+def key(word):
+    """ Returns the index in DECODE of the entry a word is decoded by. """
+    opcode = word >> 26
+    if opcode > 1:
+        return opcode
+    return 64 * (opcode + 1) + (word & 0x3f)
+
+def fields(word, addr):
+    """ Returns the fields of a word at addr, in the order of TEMPLATES. """
+    immediate = ((word & 0xffff) ^ 0x8000) - 0x8000
+    offset = ((word & 0x3ffffff) ^ 0x2000000) - 0x2000000
+    return ((word >> 21) & 0x1f, (word >> 16) & 0x1f, (word >> 11) & 0x1f,
+            immediate, addr + 4 + immediate, addr + 4 + offset,
+            (word ^ 0x80000000) - 0x80000000)
+
+def decodeword(word, addr):
+    """ Returns the source line of the word at addr. """
+    index = key(word)
+    if word & ZEROMASKS[index]:
+        return WORDTEMPLATE.format(*fields(word, addr))
+    return FORMATTERS[index](*fields(word, addr))
+
+def decodewords(words, addresses):
+    """ Returns the source lines of a list of words at a list of addresses. """
+    formatters, zeromasks = FORMATTERS, ZEROMASKS
+    wordformat = WORDTEMPLATE.format
+    lines = []
+    for word, addr in zip(words, addresses):
+        opcode = word >> 26
+        index = opcode if opcode > 1 else 64 * (opcode + 1) + (word & 0x3f)
+        immediate = ((word & 0xffff) ^ 0x8000) - 0x8000
+        offset = ((word & 0x3ffffff) ^ 0x2000000) - 0x2000000
+        formatter = wordformat if word & zeromasks[index] else formatters[index]
+        lines.append(formatter((word >> 21) & 0x1f, (word >> 16) & 0x1f,
+            (word >> 11) & 0x1f, immediate, addr + 4 + immediate,
+            addr + 4 + offset, (word ^ 0x80000000) - 0x80000000))
+    return lines
+
+def decodevector(words, addresses):
+    """ Returns the same as decodewords, extracting the fields with NumPy. """
+    words = numpy.asarray(words, dtype=numpy.int64)
+    addresses = numpy.asarray(addresses, dtype=numpy.int64)
+    opcode = words >> 26
+    index = numpy.where(opcode > 1, opcode, 64 * (opcode + 1) + (words & 0x3f))
+    invalid = (words & numpy.array(ZEROMASKS, dtype=numpy.int64)[index]) != 0
+    index = numpy.where(invalid, len(DECODE), index)
+    immediate = ((words & 0xffff) ^ 0x8000) - 0x8000
+    offset = ((words & 0x3ffffff) ^ 0x2000000) - 0x2000000
+    columns = [(words >> 21) & 0x1f, (words >> 16) & 0x1f, (words >> 11) & 0x1f,
+               immediate, addresses + 4 + immediate, addresses + 4 + offset,
+               ((words ^ 0x80000000) - 0x80000000)]
+    formatters = FORMATTERS + [WORDTEMPLATE.format]
+    return [formatters[entry](*row) for entry, row in
+            zip(index.tolist(), zip(*[column.tolist() for column in columns]))]
+
+def readhex(hexdata):
+    """ Returns the address and hex of every line of a .hex listing. """
+    entries = []
+    for line in hexdata.splitlines():
+        if not line.strip():
+            continue
+        addr, sep, hexdigits = line.partition(":")
+        if not sep:
+            raise ValueError("Not a .hex line: " + line)
+        entries.append((int(addr, 16), hexdigits.strip()))
+    return entries
+
+def readimage(image):
+    """ Returns the address and hex of every word of a memory image. """
+    whole = len(image) - len(image) % 4
+    entries = [(addr, "%08x" % word) for addr, word in
+               zip(xrange(0, whole, 4), imagewords(image[:whole]))]
+    if whole < len(image):
+        entries.append((whole, image[whole:].encode("hex")))
+    return entries
+
+def imagewords(image):
+    """ Returns the big-endian words of an image whose size is a multiple of 4. """
+    words = array.array("I" if array.array("I").itemsize == 4 else "L")
+    words.fromstring(image)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tolist()
+
+def listing(entries, vector=False):
+    """ Returns the source listing of the entries of an assembled program. """
+    wordentries = [(addr, hexdigits) for addr, hexdigits in entries
+                   if len(hexdigits) == 8]
+    addresses = [addr for addr, hexdigits in wordentries]
+    words = [int(hexdigits, 16) for addr, hexdigits in wordentries]
+    decoder = decodevector if vector else decodewords
+    decoded = iter(decoder(words, addresses))
+    lines = []
+    nextaddr = None
+    for addr, hexdigits in entries:
+        if len(hexdigits) != 8:
+            lines.append("%-26s; %08x: %s" % ("", addr, hexdigits))
+            continue
+        if addr != nextaddr:
+            lines.append(".text {0:x}".format(addr))
+        lines.append("%-26s; %08x: %s" % (next(decoded), addr, hexdigits))
+        nextaddr = addr + 4
+    return "\n".join(lines)
+
+def check(entries, sourcelisting):
+    """
+    Assembles a listing again and compares it with the entries it came from.
+
+    Returns the list of mismatches, each the expected and the assembled line,
+    None if a line is missing. Entries that are not words are not compared.
+    """
+    expected = ["%08x: %s" % entry for entry in entries if len(entry[1]) == 8]
+    assembled = dlxparser.run(sourcelisting).splitlines()
+    mismatches = [(want, got) for want, got in zip(expected, assembled)
+                  if want != got]
+    for want in expected[len(assembled):]:
+        mismatches.append((want, None))
+    for got in assembled[len(expected):]:
+        mismatches.append((None, got))
+    return mismatches
+
+def parseargs(argv):
+    """ Parses command line arguments. """
+    parser = argparse.ArgumentParser(description="Disassembles DLX programs.")
+    parser.add_argument("inputfile", help="a .hex listing or .bin image")
+    parser.add_argument("-o", "--output",
+        help="output file (default: the input with the extension .dis)")
+    parser.add_argument("--vector", action="store_true",
+        help="extract fields in bulk with NumPy")
+    parser.add_argument("--check", action="store_true",
+        help="assemble the listing again and report any word that differs")
+    args = parser.parse_args(argv)
+    if args.vector and numpy is None:
+        parser.error("--vector requires NumPy")
+    return args
+
+def main():
+    """ Main function. Disassembles the input and writes the listing. """
+    args = parseargs(sys.argv[1:])
+    filepath, extension = os.path.splitext(args.inputfile)
+    output = args.output or filepath + ".dis"
+    try:
+        if extension == ".bin":
+            with open(args.inputfile, "rb") as infile:
+                entries = readimage(infile.read())
+        else:
+            with open(args.inputfile, "r") as infile:
+                entries = readhex(infile.read())
+    except (IOError, ValueError), exc:
+        sys.exit(str(exc))
+    sourcelisting = listing(entries, args.vector)
+    with open(output, "w") as outfile:
+        outfile.write(sourcelisting)
+    if args.check:
+        mismatches = check(entries, sourcelisting)
+        for want, got in mismatches[:20]:
+            sys.stderr.write("expected {0}, assembled {1}\n".format(want, got))
+        if mismatches:
+            sys.exit("{0} words differ".format(len(mismatches)))
+
+if __name__ == "__main__":
+    main()
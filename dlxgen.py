@@ -0,0 +1,151 @@
+"""
+DLX Program Generator
+=====================
+
+Generates synthetic DLX programs for benchmarking the assembler. Programs are
+built from a seeded random generator, so the same seed and size always give
+the same program.
+
+A program is a text section followed by a data section:
+    - The text section uses every opcode in the opcode tables, each written in
+      the operand form its grammar in dlxparser.OPERANDS accepts. Code is cut
+      into short blocks that each start with a label, and branches and jumps
+      mostly go forward to labels a few blocks on.
+    - The data section has long .word, .float and .double lists, .asciiz
+      strings, and .space and .align between them. Loads and stores refer
+      to its labels.
+
+With .text and .data starting the sections, every directive in
+directives.DIRECTIVES is used but .include, as a program is a single file.
+
+Usage:
+    python dlxgen.py lines [seed] > program.dlx
+"""
+
+import sys, random
+import dlxparser
+from instructions import OPCODES
+
+# Share of the lines of a program that belong to the data section.
+DATAFRACTION = 0.2
+
+# Mean number of instructions in a labelled block of code.
+BLOCKLENGTH = 8
+
+# Number of values on a .word, .float or .double line.
+VALUESPERLINE = 16
+
+WORDS = ["alpha", "beta", "gamma", "delta", "load", "store", "branch", "table"]
+
+def generate(numlines, seed=0):
+    """ Generates the lines of a program of exactly numlines lines. """
+    rand = random.Random(seed)
+    datalines = int(numlines * DATAFRACTION)
+    codelines = numlines - datalines
+    datalabels = max(1, datalines // 4) if datalines > 1 else 0
+    for line in generatetext(rand, codelines, datalabels):
+        yield line
+    for line in generatedata(rand, datalines, datalabels, codelines * 4):
+        yield line
+
+def generatetext(rand, numlines, datalabels):
+    """ Generates the text section, numlines lines long. """
+    if numlines <= 0:
+        return
+    mnemonics = sorted(OPCODES)
+    numblocks = max(1, numlines // BLOCKLENGTH)
+    yield ".text 0"
+    block = 0
+    for index in range(1, numlines):
+        # Every opcode appears once before choices become random
+        if index <= len(mnemonics):
+            mnemonic = mnemonics[index - 1]
+        else:
+            mnemonic = rand.choice(mnemonics)
+        line = instructionline(rand, mnemonic, block, numblocks, datalabels)
+        if index * numblocks // numlines > block or index == 1:
+            block = index * numblocks // numlines
+            line = "B{0}: {1}".format(block, line)
+        yield line
+
+def instructionline(rand, mnemonic, block, numblocks, datalabels):
+    """ Returns an instruction line for mnemonic in the form it accepts. """
+    grammar = dlxparser.OPERANDS[mnemonic]
+    reg = lambda: "r{0}".format(rand.randrange(32))
+    if grammar is dlxparser.RTYPEOPERANDS:
+        operands = "{0}, {1}, {2}".format(reg(), reg(), reg())
+    elif grammar is dlxparser.ITYPEOPERANDS:
+        operands = "{0}, {1}, {2}".format(reg(), reg(), rand.randrange(-512, 512))
+    elif grammar is dlxparser.LOADOPERANDS:
+        if not datalabels or rand.random() < 0.5:
+            operands = "{0}, {1}({2})".format(reg(), rand.randrange(256), reg())
+        else:
+            operands = "{0}, D{1}".format(reg(), rand.randrange(datalabels))
+    elif grammar is dlxparser.STOREOPERANDS:
+        if not datalabels or rand.random() < 0.5:
+            operands = "{0}({1}), {2}".format(rand.randrange(256), reg(), reg())
+        else:
+            operands = "D{0}, {1}".format(rand.randrange(datalabels), reg())
+    elif grammar is dlxparser.BRANCHOPERANDS:
+        operands = "{0}, {1}".format(reg(), target(rand, block, numblocks))
+    elif grammar is dlxparser.REGISTEROPERANDS:
+        operands = reg()
+    elif grammar is dlxparser.NAMEOPERANDS:
+        if mnemonic == "trap":
+            operands = str(rand.randrange(8))
+        else:
+            operands = target(rand, block, numblocks)
+    else:
+        operands = ""
+    return (mnemonic + " " + operands).rstrip()
+
+def target(rand, block, numblocks):
+    """ Returns a branch target a few blocks away, usually forward. """
+    if rand.random() < 0.8:
+        block = min(numblocks - 1, block + rand.randrange(1, 5))
+    else:
+        block = max(0, block - rand.randrange(4))
+    return "B{0}".format(block)
+
+def generatedata(rand, numlines, datalabels, dataaddr):
+    """ Generates the data section, numlines lines long, at dataaddr. """
+    if numlines <= 0:
+        return
+    yield ".data {0:x}".format(dataaddr)
+    kinds = [".word", ".float", ".double", ".asciiz", ".space", ".align"]
+    label = 0
+    for index in range(1, numlines):
+        kind = kinds[index % len(kinds)] if index <= len(kinds) else None
+        if kind is None:
+            kind = rand.choice(kinds[:4] * 4 + kinds[4:])
+        line = dataline(rand, kind)
+        if label < datalabels and kind not in (".space", ".align"):
+            line = "D{0}: {1}".format(label, line)
+            label = label + 1
+        yield line
+
+def dataline(rand, kind):
+    """ Returns a line of the given data directive. """
+    if kind == ".word":
+        values = [str(rand.randrange(-1 << 31, 1 << 31))
+                  for _ in range(VALUESPERLINE)]
+    elif kind in (".float", ".double"):
+        values = [repr(rand.uniform(-1e6, 1e6)) for _ in range(VALUESPERLINE)]
+    elif kind == ".asciiz":
+        values = ['"{0}"'.format(" ".join(rand.sample(WORDS, 3)))
+                  for _ in range(rand.randrange(1, 4))]
+    elif kind == ".space":
+        values = [str(rand.randrange(1, 64))]
+    else:
+        values = [str(rand.randrange(1, 4))]
+    return kind + " " + ", ".join(values)
+
+def main():
+    """ Main function. Writes a program of the requested size to stdout. """
+    numlines = int(sys.argv[1])
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    for line in generate(numlines, seed):
+        sys.stdout.write(line + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+DLX Memory Image
+================
+
+Lays an assembled program out as a big-endian binary memory image, which a 
+loader can copy or map straight into memory. Byte n of the image holds the 
+byte assembled to address n, and addresses nothing was assembled to are zero.
+
+Line objects are placed by their raw encodings: instructions provide their 
+word through encodeword, data directives provide all their bytes at once 
+through packblock. 
+Nothing passes through the hex text of the .hex output. 
+"""
+
+import os, struct, mmap
+import dlxparser, instructions
+
+# Images at least this many bytes long are placed straight into a memory map
+# of the output file instead of being built in memory first.
+MMAPTHRESHOLD = 1 << 26
+
+WORD = struct.Struct(">I")
+
+def run(inputdata, basedir=os.curdir):
+    """ Assembles the program in inputdata and returns its image. """
+    assembler = dlxparser.Assembler(basedir)
+    instructionlist = assembler.firstpass(inputdata)
+    image = bytearray(imagesize(instructionlist))
+    place(assembler, assembler.resolveall(instructionlist), image)
+    return image
+
+def imagesize(instructionlist):
+    """ Returns the number of bytes needed to hold every line object. """
+    curraddr = highestaddr = 0
+    for lineobj in instructionlist:
+        curraddr = lineobj.nextaddress(curraddr)
+        highestaddr = max(highestaddr, curraddr)
+    return highestaddr
+
+def place(assembler, instructionlist, image, curraddr=0):
+    """ 
+    Writes the encoding of every line object into image at its address.
+
+    Symbols are resolved through assembler, which must be the Assembler that
+    parsed the line objects. The first object is placed at curraddr, which
+    is 0 for a whole program.
+    """
+    for lineobj in instructionlist:
+        if isinstance(lineobj, instructions.Instruction):
+            word = assembler.encodeword(lineobj, curraddr)
+            WORD.pack_into(image, curraddr, word)
+        else:
+            packed = lineobj.packblock()
+            if packed:
+                image[curraddr:curraddr + len(packed)] = packed
+        curraddr = lineobj.nextaddress(curraddr)
+
+def write(assembler, instructionlist, size, path, placer=place):
+    """
+    Writes the size byte long image of the line objects to path. 
+
+    instructionlist may be any iterable, so line objects can be placed as 
+    they are parsed. They are placed by placer, which takes the same 
+    arguments as place. Images of at least MMAPTHRESHOLD bytes are placed 
+    straight into a memory map of the output file, making the file the only 
+    copy of the image.
+    """
+    if size < MMAPTHRESHOLD:
+        image = bytearray(size)
+        placer(assembler, instructionlist, image)
+        with open(path, "wb") as outfile:
+            outfile.write(image)
+        return
+    with open(path, "w+b") as outfile:
+        outfile.truncate(size)
+        image = mmap.mmap(outfile.fileno(), size)
+        try:
+            placer(assembler, instructionlist, image)
+            image.flush()
+        finally:
+            image.close()
+
+def stream(infile, path, basedir=os.curdir):
+    """
+    Assembles the program in infile straight to an image file at path.
+
+    As with Assembler.stream, the input is read once to size the image and 
+    collect symbols, then again to place each line as it is parsed. 
+    """
+    assembler = dlxparser.Assembler(basedir)
+    size = assembler.scanlines(infile)
+    infile.seek(0)
+    lineobjs = assembler.checksymbols(assembler.parselines(infile, False))
+    write(assembler, lineobjs, size, path)
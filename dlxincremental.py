@@ -0,0 +1,221 @@
+"""
+Incremental Assembly
+====================
+
+Re-assembles a program after an edit without redoing the work for the lines
+that did not change. An IncrementalAssembler keeps the state of the last
+program it assembled, one entry per source line:
+
+    - the parse of the line: its label and its directive or instruction
+      object, shared through a cache keyed by the text of the line
+    - the symbol the line refers to, if any
+    - the address the line is placed at
+    - the encoding of the line, and its output with the address added
+
+When the program is updated, the lines that differ from the last version are
+found by trimming the unchanged lines off both ends. Only those lines are
+parsed again. Addresses are recomputed from the first changed line onward
+until they agree with the old ones again, and a line is only encoded again if
+it is new, if a symbol it refers to changed value or if it is PC relative
+and its address moved. Other lines that moved only have their addresses 
+written again.
+"""
+
+import dlxparser, instructions
+from dlxparser import splitline, linehandler, symbolof
+
+# Number of lines compared at once when looking for the edited lines.
+COMPARECHUNK = 1024
+
+class IncrementalAssembler(dlxparser.Assembler):
+    """
+    An Assembler that keeps its parse and encodings between runs.
+
+    Call update with the full text of the program every time it changes. The
+    first update assembles everything; later ones only redo the lines the
+    edit affected.
+    """
+
+    def __init__(self):
+        super(IncrementalAssembler, self).__init__()
+        self.reset()
+
+    def reset(self):
+        """ Forgets the last program, so the next update starts afresh. """
+        self.symtab = {}
+        self.cache = {}
+        self.lines = []
+        self.parsed = []
+        self.symbols = []
+        self.addresses = []
+        self.encodings = []
+        self.fragments = []
+
+    def run(self, inputdata):
+        """ Assembles the program in inputdata and returns the output. """
+        return self.update(inputdata)
+
+    def update(self, inputdata):
+        """
+        Brings the assembled program up to date with inputdata.
+
+        Returns the full output, identical to what Assembler.run would give.
+        If a changed line fails to parse, the error is raised and the kept
+        state is that of the last program, so the next update only redoes
+        the lines that differ from it. If the update fails later on, the kept
+        state is dropped and the next update assembles from scratch.
+        """
+        newlines = inputdata.splitlines()
+        try:
+            self.splice(newlines)
+        except Exception:
+            if self.lines is newlines:
+                self.reset()
+            raise
+        return "\n".join([fragment for fragment in self.fragments if fragment])
+
+    def splice(self, newlines):
+        """ Replaces the kept lines by newlines, redoing what they affect. """
+        oldlines = self.lines
+        first = commonprefix(oldlines, newlines)
+        common = commonprefix(oldlines[first:][::-1], newlines[first:][::-1])
+        oldend, newend = len(oldlines) - common, len(newlines) - common
+
+        # Parse the new lines before changing anything else
+        cache = self.cache
+        inserted = []
+        for line in newlines[first:newend]:
+            if line not in cache:
+                splitted = splitline(line)
+                if splitted is None:
+                    cache[line] = None
+                else:
+                    label, token1, statement = splitted
+                    if token1 == ".include":
+                        raise Exception(".include is not supported by "
+                                        "incremental assembly")
+                    cache[line] = (label, linehandler(token1, statement))
+            inserted.append(cache[line])
+
+        self.lines = newlines
+        removedsymbols = set()
+        for parsed in self.parsed[first:oldend]:
+            if parsed is not None and parsed[0] is not None:
+                del self.symtab[parsed[0]]
+                removedsymbols.add(parsed[0])
+        self.parsed[first:oldend] = inserted
+        self.symbols[first:oldend] = [parsed and symbolof(parsed[1])
+                                      for parsed in inserted]
+        self.addresses[first:oldend] = [None] * len(inserted)
+        self.encodings[first:oldend] = [None] * len(inserted)
+        self.fragments[first:oldend] = [None] * len(inserted)
+
+        changedsymbols = self.relocate(first, newend) | removedsymbols
+        try:
+            self.reencode(first, newend, changedsymbols)
+        except Exception:
+            # Undefined symbols are reported first and all at once, as by
+            # Assembler.resolveall, whichever line failed to encode
+            list(self.checksymbols(parsed[1] for parsed in self.parsed
+                                   if parsed is not None))
+            raise
+        if len(cache) > 2 * len(newlines):
+            self.cache = dict((line, cache[line]) for line in newlines)
+
+    def relocate(self, first, newend):
+        """
+        Recomputes addresses and labels from line first onward.
+
+        Lines from first up to newend are new. Past them, addresses are only
+        followed until one agrees with its old value, since every later
+        address then does as well. Returns the set of labels whose value
+        changed. Lines whose address changed have their output cleared, and 
+        their encoding too if it is PC relative.
+        """
+        parsed, addresses = self.parsed, self.addresses
+        encodings, fragments = self.encodings, self.fragments
+        curraddr = 0
+        for index in xrange(first - 1, -1, -1):
+            if parsed[index] is not None:
+                curraddr = parsed[index][1].nextaddress(addresses[index])
+                break
+        changedsymbols = set()
+        for index in xrange(first, len(parsed)):
+            if parsed[index] is None:
+                continue
+            label, lineobj = parsed[index]
+            if index < newend:
+                if label is not None:
+                    self.definelabel(label, curraddr)
+                    changedsymbols.add(label)
+            elif addresses[index] == curraddr:
+                break
+            else:
+                fragments[index] = None
+                if instructions.needsPC(lineobj):
+                    encodings[index] = None
+                if label is not None:
+                    self.symtab[label] = curraddr
+                    changedsymbols.add(label)
+            addresses[index] = curraddr
+            curraddr = lineobj.nextaddress(curraddr)
+        return changedsymbols
+
+    def reencode(self, first, newend, changedsymbols):
+        """
+        Encodes every line whose output was cleared or whose symbol changed.
+
+        Without changed symbols, the lines to encode are the new ones and the
+        run of moved lines after them. Otherwise every line is checked for a
+        reference to one of the changed symbols.
+        """
+        encodings, fragments = self.encodings, self.fragments
+        if changedsymbols:
+            symbols = self.symbols
+            for index in xrange(len(fragments)):
+                if symbols[index] in changedsymbols:
+                    encodings[index] = None
+                    self.reencodeline(index)
+                elif fragments[index] is None:
+                    self.reencodeline(index)
+            return
+        for index in xrange(first, len(fragments)):
+            if fragments[index] is None:
+                self.reencodeline(index)
+            elif index >= newend and self.parsed[index] is not None:
+                break
+
+    def reencodeline(self, index):
+        """ 
+        Writes the output of the line at index for its current address. 
+
+        The line is only encoded again if its encoding was cleared.
+        """
+        parsed = self.parsed[index]
+        if parsed is None: # Line was a comment
+            self.fragments[index] = ""
+            return
+        lineobj, curraddr = parsed[1], self.addresses[index]
+        encoding = self.encodings[index]
+        if encoding is None:
+            encoding = self.encode(lineobj, curraddr)
+            self.encodings[index] = encoding
+        if not encoding:
+            self.fragments[index] = ""
+        elif type(encoding) is str:
+            self.fragments[index] = "{0:08x}: {1}".format(curraddr, encoding)
+        else:
+            addresses = lineobj.nextaddresses(curraddr)
+            self.fragments[index] = "\n".join(["{0:08x}: {1}".format(addr, enc)
+                for addr, enc in zip(addresses, encoding)])
+
+def commonprefix(oldlines, newlines):
+    """ Returns the number of leading lines two lists of lines share. """
+    limit = min(len(oldlines), len(newlines))
+    common = 0
+    while (common + COMPARECHUNK <= limit and oldlines[common:common + COMPARECHUNK]
+            == newlines[common:common + COMPARECHUNK]):
+        common = common + COMPARECHUNK
+    while common < limit and oldlines[common] == newlines[common]:
+        common = common + 1
+    return common
@@ -0,0 +1,174 @@
+"""
+DLX Linker
+==========
+
+Links the relocatable objects written by dlxas --format obj (see dlxobject)
+into one program.
+
+Text sections are placed one after the other from the text base, in the order
+the objects are given, and data sections likewise from the data base, which
+by default follows the text. Each section starts at a multiple of its
+alignment, and at least of SECTIONALIGN. The labels of all objects then form
+one symbol table, and every relocated field is filled in from it. Symbols
+defined twice or used without being defined are errors, all reported at once.
+
+The program is written as a .hex listing, the same as dlxas would write for
+it, as a .bin memory image or as a .seg segment map.
+
+Usage:
+    python dlxlink.py [-o output] [--format {hex,bin,seg}]
+                      [--text-base addr] [--data-base addr] a.obj b.obj ...
+"""
+
+import sys, os, argparse, binascii
+import dlxparser, dlxobject, dlxsegments
+
+# Smallest alignment of a section, in bytes.
+SECTIONALIGN = 8
+
+MASKS = {"abs16": 0xffff, "rel16": 0xffff, "rel26": 0x3ffffff}
+
+def link(objects, textbase=0, database=None):
+    """
+    Links a list of objects. Returns the address and hex of every item.
+
+    Items come section by section in the order they were placed.
+    """
+    placed = []
+    curraddr = textbase
+    for name in dlxobject.SECTIONS:
+        if name == "data" and database is not None:
+            curraddr = database
+        for objectmodule in objects:
+            section = objectmodule["sections"][name]
+            alignment = max(SECTIONALIGN, 1 << section["align"])
+            curraddr = (curraddr + alignment - 1) // alignment * alignment
+            placed.append((curraddr, objectmodule, name))
+            curraddr = curraddr + section["size"]
+    checkoverlaps(placed)
+    symtab = symbols(placed)
+
+    bases = dict(((id(objectmodule), name), base)
+                 for base, objectmodule, name in placed)
+    relocated = {}
+    undefined = []
+    for objectmodule in objects:
+        for name, index, kind, symbol, addend in objectmodule["relocations"]:
+            if symbol is not None and symbol not in symtab:
+                if symbol not in undefined:
+                    undefined.append(symbol)
+                continue
+            base = bases[(id(objectmodule), name)]
+            offset, hexword = objectmodule["sections"][name]["items"][index]
+            value = (symtab[symbol] if symbol is not None else 0) + addend
+            if kind != "abs16":
+                value = value - (base + offset + 4)
+            word = int(hexword, 16) | (value & MASKS[kind])
+            relocated[(id(objectmodule), name, index)] = "{0:08x}".format(word)
+    if undefined:
+        raise dlxparser.undefinederror(undefined)
+
+    items = []
+    for base, objectmodule, name in placed:
+        key = id(objectmodule)
+        for index, (offset, hexdata) in enumerate(
+                objectmodule["sections"][name]["items"]):
+            hexdata = relocated.get((key, name, index), hexdata)
+            items.append((base + offset, str(hexdata)))
+    return items
+
+def checkoverlaps(placed):
+    """ Raises an exception if any two placed sections overlap. """
+    ranges = sorted((base, base + objectmodule["sections"][name]["size"])
+                    for base, objectmodule, name in placed
+                    if objectmodule["sections"][name]["size"])
+    for (start, end), (nextstart, nextend) in zip(ranges, ranges[1:]):
+        if nextstart < end:
+            raise Exception("Sections overlap at {0:#010x}".format(nextstart))
+
+def symbols(placed):
+    """ Returns the symbol table of placed sections. """
+    symtab = {}
+    duplicates = []
+    for base, objectmodule, name in placed:
+        for symbol, (section, offset) in objectmodule["symbols"].items():
+            if section != name:
+                continue
+            if symbol in symtab and symbol not in duplicates:
+                duplicates.append(symbol)
+            symtab[symbol] = base + offset
+    if len(duplicates) == 1:
+        raise Exception("Duplicate symbol: " + duplicates[0])
+    if duplicates:
+        raise Exception("Duplicate symbols: " + ", ".join(sorted(duplicates)))
+    return symtab
+
+def hexlisting(items):
+    """ Returns the .hex listing of linked items. """
+    return "\n".join(["%08x: %s" % item for item in items])
+
+def image(items):
+    """ Returns the memory image of linked items. """
+    size = max([addr + len(hexdata) // 2 for addr, hexdata in items] or [0])
+    memory = bytearray(size)
+    for addr, hexdata in items:
+        data = binascii.unhexlify(hexdata)
+        memory[addr:addr + len(data)] = data
+    return memory
+
+def segmentmap(items):
+    """ Returns the segment records of linked items. """
+    segments = dlxsegments.SegmentMap()
+    for addr, hexdata in items:
+        segments.write(addr, binascii.unhexlify(hexdata))
+    return "\n".join(segments.records())
+
+def parseaddress(text):
+    """ Parses a hex address argument. """
+    try:
+        return int(text, 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a hex address: " + text)
+
+def parseargs(argv):
+    """ Parses command line arguments. """
+    parser = argparse.ArgumentParser(description="Links DLX objects.")
+    parser.add_argument("objects", nargs="+", metavar="object",
+        help="an object written by dlxas.py --format obj")
+    parser.add_argument("-o", "--output",
+        help="output file (default: the first object with the format's "
+            "extension)")
+    parser.add_argument("--format", choices=["hex", "bin", "seg"],
+        default="hex", help="write a .hex listing (default), a .bin image or "
+            "a .seg segment map")
+    parser.add_argument("--text-base", type=parseaddress, default=0,
+        metavar="ADDR", help="hex address of the first text section "
+            "(default: 0)")
+    parser.add_argument("--data-base", type=parseaddress, metavar="ADDR",
+        help="hex address of the first data section (default: after the "
+            "text)")
+    return parser.parse_args(argv)
+
+def main():
+    """ Main function. Links the objects and writes the program. """
+    args = parseargs(sys.argv[1:])
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.objects[0])[0] + "." + args.format
+    try:
+        objects = [dlxobject.load(path) for path in args.objects]
+        items = link(objects, args.text_base, args.data_base)
+    except (IOError, ValueError), exc:
+        sys.exit(str(exc))
+    except Exception, exc:
+        sys.exit("link failed: {0}".format(exc))
+    if args.format == "bin":
+        with open(output, "wb") as outfile:
+            outfile.write(image(items))
+    else:
+        outputdata = hexlisting(items) if args.format == "hex" else segmentmap(items)
+        with open(output, "w") as outfile:
+            outfile.write(outputdata)
+
+if __name__ == "__main__":
+    main()
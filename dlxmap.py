@@ -0,0 +1,229 @@
+"""
+Source Map
+==========
+
+Maps the addresses of an assembled program back to the source lines they
+came from, for the --map flag of dlxas, and resolves addresses with it.
+
+The map holds one entry for every line that puts bytes in memory: an
+instruction or a data directive. An entry is the address range the line
+fills and its file and line number, counting included files as files of
+their own. The map also holds the symbol table, so an address can be given
+as the label before it plus an offset.
+
+Maps are saved in a compact binary form, big-endian like the memory image:
+
+    header    MAGIC, then the number of entries, files and symbols (words)
+    entries   four columns of words, each sorted by the first: the start and
+              end address, the file index and the line number of every entry
+    symbols   one column: the address of every symbol, sorted
+    names     one column: the end of every name in the name block, for the
+              symbols in order and then the files
+    block     the names, one after the other
+
+Nothing is read up front. A SourceMap maps the file and finds an address by
+bisecting the start column in place, so the map of a program of any size
+opens at once. With NumPy, resolveall looks up whole traces of addresses in
+one search.
+
+Usage:
+    python dlxmap.py program.map [address ...]
+
+Addresses are in hex, read from standard input if none are given.
+"""
+
+import sys, os, mmap, bisect, struct
+from itertools import izip_longest
+import dlxparser, instructions
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = "DLXMAP\x00\x01"
+
+WORD = struct.Struct(">I")
+HEADER = struct.Struct(">8sIII")
+
+def build(inputfile, basedir=None):
+    """
+    Assembles the first pass of inputfile and returns its map.
+
+    The map is a list of entries (start, end, file index, line number)
+    sorted by address, the list of file names and the symbol table.
+    """
+    basedir = basedir or os.path.dirname(inputfile) or os.curdir
+    assembler = dlxparser.Assembler(basedir)
+    files = [inputfile]
+    entries = []
+    curraddr = 0
+    # The input is read twice, line by line, rather than held in memory
+    with open(inputfile, "r") as infile, open(inputfile, "r") as originfile:
+        for lineobj, origin in izip_longest(assembler.parselines(infile),
+                sources(originfile, 0, basedir, files)):
+            if lineobj is None or origin is None:
+                raise Exception("Source lines and line objects do not match")
+            nextaddr = lineobj.nextaddress(curraddr)
+            if (isinstance(lineobj, instructions.Instruction)
+                    or lineobj.packblock()):
+                entries.append((curraddr, nextaddr) + origin)
+            curraddr = nextaddr
+    entries.sort()
+    return entries, files, assembler.symtab
+
+def sources(lines, fileindex, directory, files):
+    """
+    Generates the file index and line number of every line object of lines.
+
+    Follows Assembler.parselines line by line, expanding includes, whose
+    names are added to files. Included files are named by their real path,
+    as the Assembler finds them.
+    """
+    for lineno, line in enumerate(lines, 1):
+        splitted = dlxparser.splitline(line)
+        if splitted is None: # Line was a comment
+            continue
+        label, token1, statement = splitted
+        if token1 != ".include":
+            yield fileindex, lineno
+            continue
+        path = dlxparser.linehandler(token1, statement).path()
+        path = os.path.realpath(os.path.join(directory, path))
+        files.append(path)
+        with open(path, "r") as includefile:
+            for origin in sources(includefile, len(files) - 1,
+                                  os.path.dirname(path), files):
+                yield origin
+
+def dumps(entries, files, symtab):
+    """ Returns the binary form of a map. """
+    symbols = sorted((address, name) for name, address in symtab.items())
+    names = [name for address, name in symbols] + files
+    ends = []
+    end = 0
+    for name in names:
+        end = end + len(name)
+        ends.append(end)
+    columns = [[entry[column] for entry in entries] for column in range(4)]
+    columns.append([address for address, name in symbols])
+    columns.append(ends)
+    words = [word for column in columns for word in column]
+    return (HEADER.pack(MAGIC, len(entries), len(files), len(symbols))
+            + struct.pack(">{0}I".format(len(words)), *words) + "".join(names))
+
+def save(path, sourcemap):
+    """ Writes a map, as returned by build, to path. """
+    with open(path, "wb") as mapfile:
+        mapfile.write(dumps(*sourcemap))
+
+class Column(object):
+    """ A read-only sequence of the words of a map, found in place. """
+
+    def __init__(self, data, offset, length):
+        self.data = data
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError("column index out of range")
+        return WORD.unpack_from(self.data, self.offset + 4 * index)[0]
+
+class SourceMap(object):
+    """ A map saved by save, memory-mapped for lookups. """
+
+    def __init__(self, path):
+        with open(path, "rb") as mapfile:
+            self.data = mmap.mmap(mapfile.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size:
+            raise ValueError(path + " is not a source map")
+        magic, entries, files, symbols = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a source map")
+        offset = HEADER.size
+        columns = []
+        for length in (entries,) * 4 + (symbols, symbols + files):
+            columns.append(Column(self.data, offset, length))
+            offset = offset + 4 * length
+        (self.starts, self.ends, self.fileindices, self.linenumbers,
+         self.symboladdresses, self.nameends) = columns
+        self.block = offset
+        self.filenames = {}
+
+    def close(self):
+        """ Unmaps the file. """
+        self.data.close()
+
+    def name(self, index):
+        """ Returns name index of the block: a symbol, or a file after them. """
+        start = self.nameends[index - 1] if index else 0
+        return self.data[self.block + start:self.block + self.nameends[index]]
+
+    def filename(self, fileindex):
+        """ Returns the name of a file of the map. """
+        if fileindex not in self.filenames:
+            self.filenames[fileindex] = self.name(len(self.symboladdresses)
+                                                  + fileindex)
+        return self.filenames[fileindex]
+
+    def lookup(self, address):
+        """ Returns the file and line number address came from, or None. """
+        index = bisect.bisect_right(self.starts, address) - 1
+        return self.entry(index, address)
+
+    def entry(self, index, address):
+        """ Returns the file and line of entry index if it holds address. """
+        if index < 0 or address >= self.ends[index]:
+            return None
+        return self.filename(self.fileindices[index]), self.linenumbers[index]
+
+    def symbolize(self, address):
+        """ Returns the last symbol at or before address and the offset. """
+        index = bisect.bisect_right(self.symboladdresses, address) - 1
+        if index < 0:
+            return None
+        return self.name(index), address - self.symboladdresses[index]
+
+    def resolveall(self, addresses):
+        """ Returns lookup of every address in a list, in the same order. """
+        if numpy is None or not len(self.starts):
+            return [self.lookup(address) for address in addresses]
+        starts = numpy.frombuffer(self.data, dtype=">u4",
+                                  count=len(self.starts),
+                                  offset=self.starts.offset)
+        indices = numpy.searchsorted(starts, addresses, side="right") - 1
+        return [self.entry(index, address) for index, address in
+                zip(indices.tolist(), addresses)]
+
+def describe(sourcemap, address):
+    """ Returns the line printed for an address: its source and symbol. """
+    origin = sourcemap.lookup(address)
+    symbol = sourcemap.symbolize(address)
+    text = "{0:08x} ".format(address)
+    text = text + ("{0}:{1}".format(*origin) if origin else "?")
+    if symbol:
+        text = text + " {0}+{1:#x}".format(*symbol)
+    return text
+
+def main():
+    """ Main function. Resolves addresses with a map. """
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python dlxmap.py program.map [address ...]")
+    try:
+        sourcemap = SourceMap(sys.argv[1])
+    except (IOError, ValueError), exc:
+        sys.exit(str(exc))
+    addresses = sys.argv[2:] or (line.strip() for line in sys.stdin)
+    try:
+        for address in addresses:
+            if address:
+                print describe(sourcemap, int(address, 16))
+    except ValueError, exc:
+        sys.exit(str(exc))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Relocatable Objects
+===================
+
+Assembles a single module of a larger program to a relocatable object, which
+dlxlink combines with others into the final program. Modules are assembled
+independently, so only the ones that changed need assembling again, and any
+number of them can be assembled at once.
+
+A module has two sections, text and data. .text and .data switch between
+them without an address: where the sections end up is decided by the linker.
+Inside a section everything is placed at an offset from the section start.
+
+An object is a dictionary, saved as JSON:
+
+    sections      for "text" and "data", the size of the section, its
+                  alignment as a power of two and its items: the offset and
+                  hex encoding of every line of output, i.e. of every
+                  instruction and every value of a data directive
+    symbols       every label of the module, with its section and offset
+    relocations   every instruction field that depends on where sections
+                  are placed: the section, the index of the item, the kind
+                  of field, the symbol (or None) and a number added to it
+
+Fields are encoded as zero and filled in by the linker from the relocation:
+
+    abs16   the low 16 bits of the value, for I-type label immediates
+    rel16   the value less the address after the instruction, for branches
+    rel26   the same in 26 bits, for jumps
+"""
+
+import os, json, binascii
+import dlxparser, instructions
+from dlximage import WORD
+from directives import TextDirective, DataDirective, AlignDirective
+from directives import IncludeDirective
+
+# Version of the object format. Objects of any other version are rejected.
+FORMAT = 1
+
+SECTIONS = ("text", "data")
+
+def run(inputdata, basedir=os.curdir):
+    """ Assembles the module in inputdata and returns its object as JSON. """
+    return dumps(assemble(inputdata, basedir))
+
+def assemble(inputdata, basedir=os.curdir):
+    """ Assembles the module in inputdata and returns its object. """
+    sections = dict((name, {"size": 0, "align": 0, "items": []})
+                    for name in SECTIONS)
+    symbols = {}
+    relocations = []
+    section = sections["text"]
+    sectionname = "text"
+    lineobjs, labels = dlxparser.parseinclude(dlxparser.lex(inputdata))
+    for label, lineobj in flatten(lineobjs, labels, basedir, []):
+        offset = section["size"]
+        if label is not None:
+            if label in symbols:
+                raise Exception("Duplicate symbol: " + label)
+            symbols[label] = [sectionname, offset]
+        if lineobj is None:
+            continue
+        if type(lineobj) in (TextDirective, DataDirective):
+            if lineobj.args:
+                raise Exception("Relocatable modules cannot place sections at "
+                                "an address: " + lineobj.args[0])
+            sectionname = "text" if type(lineobj) is TextDirective else "data"
+            section = sections[sectionname]
+            continue
+        items = section["items"]
+        if isinstance(lineobj, instructions.Instruction):
+            relocation = relocationof(lineobj)
+            if relocation is not None:
+                kind, symbol, addend = relocation
+                relocations.append([sectionname, len(items), kind, symbol,
+                                    addend])
+                if kind == "abs16":
+                    lineobj = lineobj.resolved(0)
+                else: # Relative to the next instruction, so encodes as zero
+                    lineobj = lineobj.resolved(offset + 4)
+            if instructions.needsPC(lineobj):
+                word = lineobj.encodeword(offset)
+            else:
+                word = lineobj.encodeword()
+            items.append([offset, binascii.hexlify(WORD.pack(word))])
+        else:
+            if type(lineobj) is AlignDirective:
+                section["align"] = max(section["align"], int(lineobj.args[0]))
+            packed = lineobj.pack()
+            if packed:
+                addresses = lineobj.nextaddresses(offset)
+                for addr, data in zip(addresses, packed):
+                    items.append([addr, binascii.hexlify(data)])
+        section["size"] = lineobj.nextaddress(offset)
+    return {"format": FORMAT, "sections": sections, "symbols": symbols,
+            "relocations": relocations}
+
+def flatten(lineobjs, labels, directory, including):
+    """
+    Generates the label and line object of every line, expanding includes.
+
+    A label on an .include line comes on its own, with None for the object.
+    """
+    for index, lineobj in enumerate(lineobjs):
+        label = labels.get(index)
+        if type(lineobj) is not IncludeDirective:
+            yield label, lineobj
+            continue
+        if label is not None:
+            yield label, None
+        path = os.path.realpath(os.path.join(directory, lineobj.path()))
+        if path in including:
+            raise Exception("Recursive include: " + path)
+        included, includedlabels = dlxparser.loadinclude(path)
+        for record in flatten(included, includedlabels, os.path.dirname(path),
+                              including + [path]):
+            yield record
+
+def relocationof(instruction):
+    """
+    Returns the relocation an instruction needs, or None.
+
+    A relocation is the kind of field, the symbol it refers to (None for a
+    number) and the number added to the symbol. Branches and jumps to a
+    number are relocated too, since they are encoded relative to where the
+    instruction ends up.
+    """
+    symbol = dlxparser.symbolof(instruction)
+    if instructions.needsPC(instruction):
+        kind = "rel26" if isinstance(instruction, instructions.JType) else "rel16"
+        if symbol is not None:
+            return kind, symbol, 0
+        if isinstance(instruction, instructions.JType):
+            return kind, None, instruction.name
+        return kind, None, instruction.immediate
+    if symbol is not None:
+        return "abs16", symbol, 0
+    return None
+
+def dumps(objectmodule):
+    """ Returns an object as JSON. """
+    return json.dumps(objectmodule, separators=(",", ":"), sort_keys=True)
+
+def load(path):
+    """ Reads the object saved at path. """
+    with open(path, "r") as objectfile:
+        try:
+            objectmodule = json.load(objectfile)
+        except ValueError:
+            raise ValueError(path + " is not an object file")
+    if objectmodule.get("format") != FORMAT:
+        raise ValueError(path + " is not an object file of format {0}".format(
+            FORMAT))
+    return objectmodule
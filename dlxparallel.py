@@ -0,0 +1,273 @@
+"""
+Parallel Assembly
+=================
+
+Runs both passes of the assembler on a set of worker processes.
+
+Parsing a line does not depend on its address, so the first pass cuts the
+input into chunks of about CHUNKBYTES at line boundaries and deals them out
+to the workers. Each worker parses its chunks, expanding includes, and keeps
+the line objects to itself. All it sends back is the layout of every chunk:
+a list of runs, one for the lines before the first line whose address
+depends on where the chunk is placed (.text, .data and .align) and one
+starting at each such line. A run is that directive, the labels of the run
+with their offsets, and the size of the lines after the directive, which
+does not depend on their address.
+
+The parent walks the layouts in input order. It adds up the sizes to find
+where each chunk starts and stores the labels at their addresses, so
+duplicates are reported as by Assembler. A chunk that failed to parse ends
+its layout with the error, which is raised once the labels of the lines
+before it are stored, so the error reported is the one the plain assembler
+reports.
+
+Once every label is stored, each chunk can be encoded on its own from the
+address it starts at. The parent sends the symbol table and those addresses
+to the workers, which encode the chunks they parsed and send back the
+output of each. Results are joined in order, so the output is identical to
+Assembler.secondpass, including the report of every undefined symbol at
+once.
+
+Workers are forked with the input in memory, so it is never sent to them,
+and the line objects never leave the process that parsed them.
+
+The second pass can also be run on its own, by secondpass, for a line list
+that has already been through the first pass in this process. The list is
+cut into chunks of CHUNKLINES lines, each tagged with the address of its
+first line, and the chunks are encoded on a pool of workers. Every worker
+is handed the symbol table and the line list once, when it starts, which
+costs nothing where processes are forked. A task is then only the bounds
+and start address of a chunk, and the results are joined as above.
+"""
+
+import os, multiprocessing
+import dlxparser
+from directives import TextDirective, DataDirective, AlignDirective
+from directives import IncludeDirective
+from dlxobject import flatten
+
+# Number of bytes of input parsed as one chunk.
+CHUNKBYTES = 1 << 20
+
+# Number of line objects encoded as one task by secondpass.
+CHUNKLINES = 1 << 16
+
+# Directives whose next address depends on the address they are placed at.
+ANCHORED = (TextDirective, DataDirective, AlignDirective)
+
+def run(inputdata, jobs=0, basedir=os.curdir):
+    """
+    Assembles the program in inputdata on jobs processes.
+
+    jobs is the number of worker processes, one per core if 0. Inputs too
+    short to fill two chunks are assembled in this process.
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    bounds = list(splitinput(inputdata))
+    if jobs <= 1 or len(bounds) <= 1:
+        return dlxparser.Assembler(basedir).run(inputdata)
+    jobs = min(jobs, len(bounds))
+    workers = []
+    try:
+        for worker in range(jobs):
+            connection, workerend = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=work, args=(
+                workerend, inputdata, bounds[worker::jobs], basedir))
+            process.daemon = True
+            process.start()
+            workerend.close()
+            workers.append((process, connection))
+        layouts = deal([conn.recv() for _process, conn in workers])
+        assembler = dlxparser.Assembler(basedir)
+        starts = place(assembler, layouts)
+        for worker, (process, connection) in enumerate(workers):
+            connection.send((assembler.symtab, starts[worker::jobs]))
+        results = deal([conn.recv() for _process, conn in workers])
+    except:
+        # Workers wait for the symbol table until they are stopped
+        for process, connection in workers:
+            process.terminate()
+        raise
+    finally:
+        for process, connection in workers:
+            connection.close()
+            process.join()
+    return join(results)
+
+def secondpass(assembler, instructionlist, jobs=0):
+    """
+    Returns the output of a first pass line list, like Assembler.secondpass.
+
+    jobs is the number of worker processes, one per core if 0. Lists too
+    short to fill two chunks are encoded in this process.
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    chunks = list(splitlist(instructionlist))
+    if jobs <= 1 or len(chunks) <= 1:
+        return assembler.secondpass(instructionlist)
+    pool = multiprocessing.Pool(min(jobs, len(chunks)), startencoder,
+                                (assembler.symtab, instructionlist))
+    try:
+        results = pool.map(encodeslice, chunks, 1)
+    finally:
+        pool.close()
+        pool.join()
+    return join(results)
+
+def splitinput(inputdata):
+    """ Generates the start and end of every chunk of inputdata. """
+    start = 0
+    while start < len(inputdata):
+        end = inputdata.find("\n", start + CHUNKBYTES)
+        end = len(inputdata) if end < 0 else end + 1
+        yield start, end
+        start = end
+
+def splitlist(instructionlist):
+    """ Generates the first index, end index and address of every chunk. """
+    curraddr = 0
+    for start in xrange(0, len(instructionlist), CHUNKLINES):
+        end = min(start + CHUNKLINES, len(instructionlist))
+        yield start, end, curraddr
+        for index in xrange(start, end):
+            curraddr = instructionlist[index].nextaddress(curraddr)
+
+def deal(perworker):
+    """ Returns the results of all workers in chunk order. """
+    jobs = len(perworker)
+    count = sum(len(results) for results in perworker)
+    return [perworker[index % jobs][index // jobs] for index in xrange(count)]
+
+def place(assembler, layouts):
+    """
+    Stores the labels of the chunks in input order. Returns their addresses.
+
+    Chunks are placed one after the other, each at the address the one
+    before it ended at. Raises the first parse error reached.
+    """
+    assembler.symtab = {}
+    starts = []
+    curraddr = 0
+    for layout, error in layouts:
+        starts.append(curraddr)
+        for anchor, labels, size in layout:
+            if anchor is not None:
+                curraddr = anchor.nextaddress(curraddr)
+            for label, offset in labels:
+                assembler.definelabel(label, curraddr + offset)
+            curraddr = curraddr + size
+        if error is not None:
+            raise error
+    return starts
+
+def join(results):
+    """ Returns the output of the chunks, like Assembler.secondpass. """
+    undefined = []
+    for text, missing, error in results:
+        for symbol in missing:
+            if symbol not in undefined:
+                undefined.append(symbol)
+    if undefined:
+        raise dlxparser.undefinederror(undefined)
+    for text, missing, error in results:
+        if error is not None:
+            raise error
+    return "\n".join([text for text, missing, error in results if text])
+
+def work(connection, inputdata, bounds, basedir):
+    """
+    Runs in a worker: parses the chunks within bounds, then encodes them.
+
+    Sends the layout and parse error of every chunk, then waits for the
+    symbol table and the address of every chunk. If parsing failed, the
+    worker is terminated instead.
+    """
+    chunks = []
+    layouts = []
+    for start, end in bounds:
+        lineobjs, layout, error = parsechunk(inputdata, start, end, basedir)
+        chunks.append(lineobjs)
+        layouts.append((layout, error))
+    connection.send(layouts)
+    symtab, starts = connection.recv()
+    assembler = dlxparser.Assembler(basedir)
+    assembler.symtab = symtab
+    connection.send([encodechunk(assembler, chunk, curraddr)
+                     for chunk, curraddr in zip(chunks, starts)])
+
+def parsechunk(inputdata, start, end, basedir):
+    """
+    Parses the chunk of inputdata from start to end.
+
+    Returns the line objects of the chunk, its layout and the error that
+    stopped parsing, or None. The layout holds every label up to that error.
+    """
+    lineobjs = []
+    run = [None, [], 0]
+    layout = [run]
+    try:
+        for label, lineobj in records(inputdata, start, end, basedir):
+            if label is not None:
+                run[1].append((label, run[2]))
+            if lineobj is None:
+                continue
+            if isinstance(lineobj, ANCHORED):
+                run = [lineobj, [], 0]
+                layout.append(run)
+            else:
+                run[2] = lineobj.nextaddress(run[2])
+            lineobjs.append(lineobj)
+    except Exception, exc:
+        return lineobjs, layout, exc
+    return lineobjs, layout, None
+
+def records(inputdata, start, end, basedir):
+    """
+    Generates the label and line object of every line of a chunk.
+
+    Includes are expanded. A label comes before its line, on its own with
+    None for the object, since it is stored even if the line fails to parse.
+    """
+    for label, token1, operands in dlxparser.lex(inputdata, start, end):
+        if label is not None:
+            yield label, None
+        lineobj = dlxparser.linehandler(token1, operands)
+        if type(lineobj) is IncludeDirective:
+            for record in flatten([lineobj], {}, basedir, []):
+                yield record
+        else:
+            yield None, lineobj
+
+# State of a worker of secondpass, set by startencoder.
+ENCODER = {}
+
+def startencoder(symtab, instructionlist):
+    """ Keeps the symbol table and line list of the program in a worker. """
+    assembler = dlxparser.Assembler()
+    assembler.symtab = symtab
+    ENCODER["assembler"] = assembler
+    ENCODER["instructionlist"] = instructionlist
+
+def encodeslice(chunk):
+    """ Runs in a worker of secondpass: encodes the chunk within bounds. """
+    start, end, curraddr = chunk
+    return encodechunk(ENCODER["assembler"],
+                       ENCODER["instructionlist"][start:end], curraddr)
+
+def encodechunk(assembler, lineobjs, curraddr):
+    """
+    Encodes one chunk starting at curraddr.
+
+    Returns the output of the chunk, the undefined symbols it refers to and
+    the error encoding failed with. The chunk is only encoded if it has no
+    undefined symbols.
+    """
+    undefined = assembler.undefinedsymbols(dlxparser.fixups(lineobjs))
+    if undefined:
+        return None, undefined, None
+    try:
+        lineobjs = assembler.resolveall(lineobjs)
+        text = "\n".join(assembler.encodelines(lineobjs, curraddr, True))
+    except Exception, exc:
+        return None, [], exc
+    return text, [], None
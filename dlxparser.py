@@ -5,128 +5,505 @@ Deluxe Assembly Parser
 This module takes as input a DLX assembly program (in a string) and returns 
 the assembled program. Assembly is done in two passes: 
     1) First, the input is parsed for symbols. When a symbol is found it is stored 
-    in the module global symbol table. Also, each line is parsed to determine 
-    what it contained, i.e. an optional label, then either an operation 
-    instruction or a directive. These are converted to objects and stored in 
-    order. 
+    in the symbol table of the Assembler doing the work. Also, each line is 
+    parsed to determine what it contained, i.e. an optional label, then 
+    either an operation instruction or a directive. These are converted to 
+    objects and stored in order. 
     2) The instruction objects are processed one by one, their encodings 
     corresponding to one or more lines of machine code output. 
+Large programs can instead be streamed from file to file with stream(), which
+reads the input once per pass and holds nothing but the symbol table.
+Each Assembler keeps its own state, so several can work at once; run() and 
+stream() assemble with a fresh one.
+A program may pull in other files with .include "file". Each included file is
+parsed once per process: its line objects and the positions of its labels are
+kept in INCLUDES under a digest of its contents, and every program including
+it again only places them at their new addresses.
+The input is split into lines and tokens in a single scan by lex(), which
+works in place on any buffer, an mmap of the input file included, and hands
+the label, first token and operand text of every line straight on.
 This module contains functionality for determining which type of instruction
 should be created for a given line. Operand values are parsed from a line using
-regualar expressions. For example:
+the regular expression grammar the opcode maps to in OPERANDS. For example:
         
         addi r1, r2, 8 --> {'rd': 1, 'rs1': 2, 'immediate': 8}
 """
 
-import re, instructions
+import os, re, hashlib, instructions
+from itertools import islice
 from instructions import I_OPCODES, J_OPCODES, R_OPCODES, R_FUNCCODES 
 from instructions import OPCODES, INSTRUCTIONS
-from directives import DIRECTIVES
+from directives import DIRECTIVES, Directive, IncludeDirective
 
-SYMTAB = {}
+# Version of the assembler. Cached output is keyed by it and by a digest of
+# the assembler's sources (see dlxcache), so a change to the code is never
+# served output of the code before it, bumped or not.
+VERSION = "1.2"
 
-def run(inputdata):
-    instructionlist = firstpass(inputdata)
-    outputdata = secondpass(instructionlist)
-    return outputdata
+# Number of output lines joined into a single write when streaming.
+STREAMCHUNK = 4096
 
-def firstpass(inputdata):
-    """ 
-    The first pass of the assembler. 
+# Parsed included files, by the SHA-1 digest of their contents. Each entry is
+# the list of line objects of the file and a dictionary from the index of a
+# labelled line object to its label.
+INCLUDES = {}
+
+def run(inputdata, basedir=os.curdir):
+    """ Assembles inputdata with a fresh Assembler and returns the output. """
+    return Assembler(basedir).run(inputdata)
+
+def stream(infile, outfile, basedir=os.curdir):
+    """ Streams infile to outfile with a fresh Assembler. See Assembler.stream """
+    Assembler(basedir).stream(infile, outfile)
+
+class Assembler(object):
+    """
+    Assembles DLX programs.
+
+    An Assembler owns the symbol table of the program it is assembling, so 
+    any number of them can be used at once, e.g. one per thread. Each run 
+    starts from an empty symbol table, so a single Assembler can also be 
+    reused for many programs. The opcode tables are shared by all Assemblers; 
+    they are loaded once when instructions is imported and never modified.
+
+    Files named by .include in the program are found relative to basedir, 
+    the directory of the program.
+    """
+
+    def __init__(self, basedir=os.curdir):
+        self.symtab = {}
+        self.basedir = basedir
+        self.including = [] # Files being included, innermost last
+
+    def run(self, inputdata):
+        """ Assembles the program in inputdata and returns the output. """
+        instructionlist = self.firstpass(inputdata)
+        outputdata = self.secondpass(instructionlist)
+        return outputdata
+
+    def stream(self, infile, outfile):
+        """
+        Assembles the program in infile, writing the output to outfile as it 
+        is encoded.
 
-    At this step, calculates addresses for labels and stores instructions,
-    rearranging them as specified by a directive. 
-    
-    Algorithmically:
+        The input is read twice rather than held in memory: the first read 
+        only collects symbols, the second parses and encodes each line and
+        passes it straight on to outfile. Memory use is therefore bounded by 
+        the symbol table, whatever the size of the program. infile must be 
+        seekable.
+        """
+        self.scanlines(infile)
+        infile.seek(0)
+        lineobjs = self.checksymbols(self.parselines(infile, False))
+        outputlines = self.encodelines(lineobjs)
+        separator = ""
+        while True:
+            chunk = list(islice(outputlines, STREAMCHUNK))
+            if not chunk:
+                break
+            outfile.write(separator + "\n".join(chunk))
+            separator = "\n"
+
+    def firstpass(self, inputdata):
+        """ 
+        The first pass of the assembler. 
+
+        At this step, calculates addresses for labels and stores instructions,
+        rearranging them as specified by a directive. 
         
-        for each line of input
-            remove comments and blank lines
-            split line into tokens
-            if first token is a label
-                store label
-                insert nop if label was on an empty line
-            if first token excluding label is an directive
-                create appropriate directive object by parsing tokens
-                increment address based on directive
-            if first token excluding label is an opcode
-                create appropriate instruction object by parsing tokens
-                increment address based on instruction length
-            add object to list of processed lines
-        return processed lines
-    """ 
+        Algorithmically:
+            
+            for each line of input
+                remove comments and blank lines
+                split line into tokens
+                if first token is a label
+                    store label
+                    insert nop if label was on an empty line
+                if first token excluding label is an directive
+                    create appropriate directive object by parsing tokens
+                    increment address based on directive
+                if first token excluding label is an opcode
+                    create appropriate instruction object by parsing tokens
+                    increment address based on instruction length
+                add object to list of processed lines
+            return processed lines
+        """ 
+        return list(self.parsestatements(lex(inputdata)))
+
+    def parselines(self, lines, definelabels=True):
+        """
+        Generates the directive or instruction object for each line of input.
+
+        Starts a new program: the symbol table is cleared and labels are 
+        stored in it at the address of the line they label. If definelabels 
+        is False an earlier pass has already stored them, and the symbol 
+        table is left as it is.
+        """
+        return self.parsestatements(splitlines(lines), definelabels)
+
+    def parsestatements(self, statements, definelabels=True):
+        """ Does the work of parselines for the statements lex() returns. """
+        if definelabels:
+            self.symtab = {}
+        curraddr = 0
+        for label, token1, operands in statements:
+            if label is not None and definelabels:
+                self.definelabel(label, curraddr)
+            lineobj = linehandler(token1, operands)
+            if token1 == ".include":
+                path = os.path.join(self.basedir, lineobj.path())
+                for lineobj in self.include(path, curraddr, definelabels):
+                    curraddr = lineobj.nextaddress(curraddr)
+                    yield lineobj
+                continue
+            curraddr = lineobj.nextaddress(curraddr)
+            yield lineobj
 
-    instructionlist = []
-    curraddr = 0
-    for line in inputdata.splitlines():
-        partitioned = line.partition(";")[0].strip()
-        if not partitioned: # Line was a comment
-            continue 
-        tokens = partitioned.split()
-        token1 = tokens[0]
-        if matchlabel(token1):
-            SYMTAB[token1.strip(":")] = curraddr
-            if len(tokens) == 1:
-                token1 = "nop"
-                partitioned = partitioned + " nop"
+    def include(self, path, curraddr, definelabels=True):
+        """
+        Generates the line objects of the included file at path.
+
+        The file is placed at curraddr. Its labels are stored as their lines
+        are reached, unless definelabels is False, and files it includes in 
+        turn are found relative to its own directory. The parse of the file 
+        comes from INCLUDES if its contents were parsed before. Labels are 
+        kept by position rather than by offset, since .align, .text and .data
+        make their addresses depend on where the file is placed.
+        """
+        path = os.path.realpath(path)
+        if path in self.including:
+            raise Exception("Recursive include: " + path)
+        lineobjs, labels = loadinclude(path)
+        directory = os.path.dirname(path)
+        self.including.append(path)
+        try:
+            for index, lineobj in enumerate(lineobjs):
+                if definelabels and index in labels:
+                    self.definelabel(labels[index], curraddr)
+                if type(lineobj) is IncludeDirective:
+                    nested = os.path.join(directory, lineobj.path())
+                    for lineobj in self.include(nested, curraddr, definelabels):
+                        curraddr = lineobj.nextaddress(curraddr)
+                        yield lineobj
+                    continue
+                curraddr = lineobj.nextaddress(curraddr)
+                yield lineobj
+        finally:
+            self.including.pop()
+
+    def scanlines(self, lines):
+        """
+        Stores the address of every label without keeping any lines.
+
+        Only directives have to be parsed to find their size. Every 
+        instruction is four bytes long, so its operands are left for the pass
+        that encodes it. Returns the highest address reached, which is the 
+        size of the memory the program occupies.
+        """
+        self.symtab = {}
+        curraddr = highestaddr = 0
+        for line in lines:
+            splitted = splitline(line)
+            if splitted is None: # Line was a comment
+                continue
+            label, token1, operands = splitted
+            if label is not None:
+                self.definelabel(label, curraddr)
+            if matchopcode(token1):
+                curraddr = curraddr + 4
+            elif token1 == ".include":
+                path = linehandler(token1, operands).path()
+                for lineobj in self.include(os.path.join(self.basedir, path),
+                                            curraddr):
+                    curraddr = lineobj.nextaddress(curraddr)
+                    highestaddr = max(highestaddr, curraddr)
             else:
-                token1 = tokens[1]
-        if matchdirective(token1):
-            directiveobj = directivehandler(partitioned)
-            curraddr = directiveobj.nextaddress(curraddr)
-            instructionlist.append(directiveobj)
-        elif matchopcode(token1):
-            instructionobj = opcodehandler(partitioned)
-            curraddr = curraddr + 4
-            instructionlist.append(instructionobj)
-        else:
-            raise Exception("Expected directive or opcode.")    
-    return instructionlist
+                curraddr = linehandler(token1, operands).nextaddress(curraddr)
+            highestaddr = max(highestaddr, curraddr)
+        return highestaddr
 
-def secondpass(instructionlist):
-    """ 
-    The second pass of the assembler. 
+    def definelabel(self, label, curraddr):
+        """ Stores a label in the symbol table, refusing to redefine one. """
+        if label in self.symtab:
+            raise Exception("Duplicate symbol: " + label)
+        self.symtab[label] = curraddr
 
-    At this step, generate encodings for every object returned by the first pass. 
+    def secondpass(self, instructionlist):
+        """ 
+        The second pass of the assembler. 
 
-    Algorithmically:
-        
-        for each line-object
-            encode object
-            concatenate encoding with current address
-            increment address based on object
-            add fully encoded line or lines to output
-        return output
-    """ 
+        At this step, generate encodings for every object returned by the 
+        first pass. 
+
+        Algorithmically:
+            
+            resolve every symbol referenced by a line-object
+            for each line-object
+                encode object
+                concatenate encoding with current address
+                increment address based on object
+                add fully encoded line or lines to output
+            return output
+        """ 
+        instructionlist = self.resolveall(instructionlist)
+        return "\n".join(self.encodelines(instructionlist, resolved=True))
+
+    def encodelines(self, instructionlist, curraddr=0, resolved=False):
+        """ 
+        Generates the lines of output for an iterable of line objects. 
+
+        The first object is placed at curraddr, which is 0 for a whole 
+        program. A directive that encodes to many lines, such as a large 
+        .word table, is formatted in one piece and given as a single string
+        of newline separated lines. If resolved is True, the line objects 
+        come from resolveall and are encoded without looking for symbols.
+        """
+        encode = self.encoderesolved if resolved else self.encode
+        for instruction in instructionlist:
+            if isinstance(instruction, Directive):
+                block = instruction.encodeblock(curraddr)
+                if block:
+                    yield block
+            else:
+                encoding = encode(instruction, curraddr)
+                yield "{0:08x}: ".format(curraddr) + encoding
+            # All objects can update the address, even if they have no encoding
+            curraddr = instruction.nextaddress(curraddr)
 
-    outputdata = []
-    curraddr = 0
-    for instruction in instructionlist:
+    def encode(self, lineobj, curraddr):
+        """ Returns the encoding of a line object placed at curraddr. """
+        return self.encoderesolved(self.resolve(lineobj), curraddr)
+
+    def encoderesolved(self, lineobj, curraddr):
+        """ Returns the encoding of a line object without symbols. """
+        if instructions.needsPC(lineobj):
+            return lineobj.encode(curraddr)
+        return lineobj.encode()
+
+    def encodeword(self, instruction, curraddr):
+        """ Returns the word an instruction placed at curraddr encodes to. """
+        instruction = self.resolve(instruction)
         if instructions.needsPC(instruction):
-            encoding = instruction.encode(curraddr)
-        else:
-            encoding = instruction.encode()
-        if encoding:
-            if type(encoding) is str: # Object required one line
-                address = "{0:08x}: ".format(curraddr)
-                outputdata.append(address + encoding)
-            elif type(encoding) is list: # Object requires multiple lines
-                addresses = instruction.nextaddresses(curraddr)
-                for addr, enc in zip(addresses, encoding):
-                    address = "{0:08x}: ".format(addr)
-                    outputdata.append(address + enc)
+            return instruction.encodeword(curraddr)
+        return instruction.encodeword()
+
+    def resolve(self, lineobj):
+        """ 
+        Returns lineobj with its symbol operand replaced by the symbol's value.
+
+        Line objects themselves are never modified, so that they can be 
+        encoded again against a different symbol table. An instruction that 
+        names a symbol is copied instead.
+        """
+        symbol = symbolof(lineobj)
+        if symbol is None:
+            return lineobj
+        return lineobj.resolved(self.lookup(symbol))
+
+    def resolveall(self, instructionlist):
+        """
+        Returns a list of line objects with every symbol resolved.
+
+        The symbols of the whole list are looked up in one step from its 
+        fixup table, so that every undefined symbol is reported at once. As 
+        with resolve, the line objects themselves are left as they are and 
+        the ones naming a symbol are replaced by resolved copies.
+        """
+        table = fixups(instructionlist)
+        values = self.resolvefixups(table)
+        resolved = list(instructionlist)
+        for (index, field, symbol, pcrelative), value in zip(table, values):
+            resolved[index] = instructionlist[index].resolved(value)
+        return resolved
+
+    def resolvefixups(self, table):
+        """
+        Returns the value of the symbol of every entry of a fixup table.
+
+        Raises an exception naming every undefined symbol if there are any.
+        """
+        undefined = self.undefinedsymbols(table)
+        if undefined:
+            raise undefinederror(undefined)
+        symtab = self.symtab
+        return [symtab[symbol] for index, field, symbol, pcrelative in table]
+
+    def undefinedsymbols(self, table):
+        """ Returns each symbol of a fixup table missing from the symbol table. """
+        symtab = self.symtab
+        undefined = []
+        seen = set()
+        for index, field, symbol, pcrelative in table:
+            if symbol not in symtab and symbol not in seen:
+                undefined.append(symbol)
+                seen.add(symbol)
+        return undefined
+
+    def checksymbols(self, lineobjs):
+        """
+        Generates line objects up to the first that names an undefined symbol.
+
+        The rest of the line objects are then only searched for other 
+        undefined symbols, and an exception naming all of them is raised, as 
+        resolveall does. This lets a streaming pass report every undefined 
+        symbol without holding the lines.
+        """
+        symtab = self.symtab
+        lineobjs = iter(lineobjs)
+        for lineobj in lineobjs:
+            symbol = symbolof(lineobj)
+            if symbol is not None and symbol not in symtab:
+                undefined = [symbol]
+                seen = set(undefined)
+                for lineobj in lineobjs:
+                    symbol = symbolof(lineobj)
+                    if (symbol is not None and symbol not in symtab 
+                            and symbol not in seen):
+                        undefined.append(symbol)
+                        seen.add(symbol)
+                raise undefinederror(undefined)
+            yield lineobj
+
+    def lookup(self, symbol):
+        """ Returns the value of a symbol from the symbol table. """
+        try:
+            return self.symtab[symbol]
+        except KeyError:
+            raise Exception("Undefined symbol: " + symbol)
+
+    def printsymtab(self):
+        """ Displays the symbol nicely. """
+        print "Symbol Table\n============"
+        for key in self.symtab:
+            if type(self.symtab[key]) is tuple:
+                print "Symbol: '{0}' Value: {1}".format(key, self.symtab[key])
             else:
-                raise Exception("Encoding was neither str nor list of str...")
-        # All objects can update the address, even if they have no encoding
-        curraddr = instruction.nextaddress(curraddr)
-    return "\n".join(outputdata) 
+                print "Symbol: '{0}'' Value: {1:#x}".format(
+                    key, int(self.symtab[key]))
 
-def matchlabel(tomatch):
-    """ Determines if given token is a valid label or not. """
-    if type(tomatch) != str:
-        return False
-    if tomatch in SYMTAB:
-        raise Exception("Duplicate symbol: " + tomatch)
-    return tomatch[len(tomatch)-1] is ":"
+def loadinclude(path):
+    """
+    Returns the line objects and labels of the file at path.
+
+    The file is read every time, but only parsed if INCLUDES holds no parse 
+    of the same contents. Line objects are never modified once parsed, so 
+    the same ones serve every program that includes the file.
+    """
+    with open(path, "rb") as includefile:
+        inputdata = includefile.read()
+    key = hashlib.sha1(inputdata).hexdigest()
+    if key not in INCLUDES:
+        INCLUDES[key] = parseinclude(lex(inputdata))
+    return INCLUDES[key]
+
+def parseinclude(statements):
+    """ Parses the statements of an included file into objects and labels. """
+    lineobjs = []
+    labels = {}
+    for label, token1, operands in statements:
+        if label is not None:
+            labels[len(lineobjs)] = label
+        lineobjs.append(linehandler(token1, operands))
+    return lineobjs, labels
+
+def fixups(instructionlist):
+    """
+    Returns the fixup table of a list of line objects.
+
+    There is an entry for every reference to a symbol: a tuple of the index
+    of the line object, the name of the field that holds the symbol, the 
+    symbol and whether the field is PC relative, i.e. is encoded as an 
+    offset from the address of the instruction.
+    """
+    table = []
+    for index, lineobj in enumerate(instructionlist):
+        symbol = symbolof(lineobj)
+        if symbol is not None:
+            if isinstance(lineobj, instructions.JType):
+                field = "name"
+            else:
+                field = "immediate"
+            table.append((index, field, symbol, instructions.needsPC(lineobj)))
+    return table
+
+def undefinederror(symbols):
+    """ Returns the exception reporting a list of undefined symbols. """
+    if len(symbols) == 1:
+        return Exception("Undefined symbol: " + symbols[0])
+    return Exception("Undefined symbols: " + ", ".join(symbols))
+
+def symbolof(lineobj):
+    """ Returns the symbol an instruction refers to, or None if it has none. """
+    if isinstance(lineobj, instructions.IType):
+        if type(lineobj.immediate) is str:
+            return lineobj.immediate
+    elif isinstance(lineobj, instructions.JType):
+        if type(lineobj.name) is str:
+            return lineobj.name
+    return None
+
+# A line of source: an optional label (a token ending in ':'), the first
+# token after it, the operand text and the comment, up to the end of the line
+# as str.splitlines finds it. Tokens are separated as by str.split.
+LINE = re.compile(r"[^\S\r\n]*"
+                  r"(?:([^\s;]*:)(?![^\s;])[^\S\r\n]*)?"  # label
+                  r"([^\s;]+)?[^\S\r\n]*"                 # first token
+                  r"([^;\r\n]*)"                          # operand text
+                  r"[^\r\n]*(?:\r\n|\r|\n)?")             # comment
+
+def lex(inputdata, pos=0, endpos=None):
+    """
+    Generates splitline() of every line of inputdata that is not blank or a 
+    comment, between offsets pos and endpos.
+
+    The input is scanned once, in place, with LINE: only the tokens of each
+    line are copied out of it, so inputdata may be an mmap of the input file
+    and is never split into lines.
+    """
+    if endpos is None:
+        endpos = len(inputdata)
+    for match in LINE.finditer(inputdata, pos, endpos):
+        label, token1, operands = match.groups()
+        if token1 is None:
+            if label is None: # Line was a comment
+                continue
+            token1 = "nop"
+        if label is not None:
+            label = label.strip(":")
+        yield label, token1, operands
+
+def splitlines(lines):
+    """ Generates splitline() of every line that is not blank or a comment. """
+    for line in lines:
+        splitted = splitline(line)
+        if splitted is not None:
+            yield splitted
+
+def splitline(line):
+    """
+    Removes the comment from a line and finds its label and first token.
+
+    Returns a tuple of the label (None if there is none), the first token 
+    after the label and the operand text following that token. A label on
+    an otherwise empty line labels a nop. Returns None if nothing but a 
+    comment or whitespace is left.
+    """
+    label, token1, operands = LINE.match(line).groups()
+    if token1 is None:
+        if label is None:
+            return None
+        token1 = "nop"
+    if label is not None:
+        label = label.strip(":")
+    return label, token1, operands
+
+def linehandler(token1, operands):
+    """ Creates the directive or instruction object for a line. """
+    if matchdirective(token1):
+        return directivehandler(token1, operands)
+    elif matchopcode(token1):
+        return opcodehandler(token1, operands)
+    raise Exception("Expected directive or opcode.")
 
 def matchopcode(tomatch):
     """ Determines if given token is a valid opcode or not. """
@@ -142,14 +519,9 @@ def matchdirective(tomatch):
         return False
     return tomatch in DIRECTIVES
 
-def directivehandler(directiveline):
+def directivehandler(directivetoken, argtext):
     """ Creates directive objects from parsing input tokens. """
-    tokens = directiveline.split()
-    directivetoken = tokens[0]
-    argtokens = tokens[1:]
-    if matchlabel(directivetoken):
-        directivetoken = tokens[1]
-        argtokens = tokens[2:]
+    argtokens = argtext.split()
     directiveclass = DIRECTIVES[directivetoken]
     # Rejoins the arguments (by spaces) then splits by comma instead
     if argtokens:
@@ -157,16 +529,7 @@ def directivehandler(directiveline):
     directiveobj = directiveclass(argtokens)
     return directiveobj
 
-def printsymtab():
-    """ Displays the symbol nicely. """
-    print "Symbol Table\n============"
-    for key in SYMTAB:
-        if type(SYMTAB[key]) is tuple:
-            print "Symbol: '{0}' Value: {1}".format(key, SYMTAB[key])
-        else:
-            print "Symbol: '{0}'' Value: {1:#x}".format(key, int(SYMTAB[key]))
-
-def opcodehandler(instructionline):
+def opcodehandler(opcodetoken, operandtext):
     """ 
     Creates the correct instruction object by parsing input tokens.
 
@@ -175,14 +538,11 @@ def opcodehandler(instructionline):
     the operands that that instruction requires. For example, an opcode token
     with the value 'addi' would be determined to require a destination register, 
     source register, and immediate value. The instruction would be parsed as such.
+    Only the text following the opcode is handed on to the operand grammar.
     """
-    tokens = instructionline.split()
-    opcodetoken = tokens[0]
-    if matchlabel(opcodetoken):
-        opcodetoken = tokens[1]
     if opcodetoken not in OPCODES:
         raise Exception(opcodetoken + " is not a valid opcode.")
-    operandvalues = parseoperands(instructionline)
+    operandvalues = parseoperands(opcodetoken, operandtext)
     opcode = OPCODES[opcodetoken]
     if opcodetoken in I_OPCODES:
         if opcodetoken in INSTRUCTIONS:
@@ -200,90 +560,110 @@ def opcodehandler(instructionline):
             instrobj = instructions.RFPU(opcode, funccode, **operandvalues)
     return instrobj
 
-def parseoperands(instructionline):
-    """ 
-    Parses tokens in a line for their values. 
+# Operand grammars. Every opcode is parsed by exactly one of these, chosen
+# from the opcode tables by mapoperands(). Group names match the keyword
+# arguments taken by the instruction classes.
+COMMA = r"\s*,\s*"
 
-    Most of the heavy (parse)lifting is done here. Returning named values 
-    allows instructions to be dynamically created by principle of which set of 
-    operands they require. 
+def register(name):
     """
+    Returns the pattern for a register operand captured as name.
+
+    Only registers 0 to 31 exist. Register fields are not masked when they
+    are encoded, so a larger number would spill into the fields beside it.
+    """
+    return r"[rRfF](?P<" + name + r">0?\d|[12]\d|3[01])\b"
+
+def immediate(name):
+    """ Returns the pattern for a number or symbol operand captured as name. """
+    return (r"(?P<" + name + r">-?0[xX][0-9a-fA-F]+|-?\d+"
+            r"|(?![rRfF]\d{1,2}\b)[A-Za-z_.$][\w.$]*)")
+
+def offset():
+    """ Returns the pattern for an offset(rs1) or name memory operand. """
+    return (r"(?=[^\s,])(?:" + immediate("immediate") + r")?"
+            r"(?:\(\s*" + register("rs1") + r"\s*\))?")
+
+def grammar(*parts):
+    """ Compiles operand parts into one anchored operand matcher. """
+    return re.compile(r"\s*" + "".join(parts) + r"\s*$")
+
+NOOPERANDS = grammar()
+RTYPEOPERANDS = grammar(                # rd, rs1[, rs2] or nothing (nop)
+    "(?:", register("rdest"), COMMA, register("rs1"),
+    "(?:", COMMA, register("rs2"), ")?)?")
+ITYPEOPERANDS = grammar(                # rd, [rs1,] immediate
+    register("rdest"), COMMA, "(?:", register("rs1"), COMMA, ")?",
+    immediate("immediate"))
+LOADOPERANDS = grammar(                 # rd, offset(rs1) or rd, name
+    register("rdest"), COMMA, offset())
+STOREOPERANDS = grammar(                # offset(rs1), rd or name, rd
+    offset(), COMMA, register("rdest"))
+BRANCHOPERANDS = grammar(               # rs1, name
+    register("rdest"), COMMA, immediate("immediate"))
+REGISTEROPERANDS = grammar(             # rs1
+    register("rs1"))
+NAMEOPERANDS = grammar(                 # name
+    immediate("name"))
 
-    # opcode rd, offset(rs1)
-    re1 = re.compile(r"\w+[ ]+[rRfF](\d{1,2}), (\d+)\([rRfF](\d{1,2})\)")
-    m1 = re1.search(instructionline)
-    if m1:
-        rdest, immediate, rs1 = m1.groups()
-        return {"rdest":int(rdest), "immediate": int(immediate), "rs1": int(rs1)}
-
-    # opcode offset(rs1), rd
-    re11 = re.compile(r"\w+[ ]+[rRfF](\d{1,2}), ((?![rRfF]\d{1,2})\D+\d*)")
-    m11 = re11.search(instructionline)
-    if m11:
-        rdest, name = m11.groups()
-        return {"rdest":int(rdest), "immediate":name}
-
-    # opcode offset(rs1), rd
-    re2 = re.compile(r"\w+[ ]+(-?\d+)\([rRfF](\d{1,2})\), [rRfF](\d{1,2})")
-    m2 = re2.search(instructionline)
-    if m2:
-        immediate, rs1, rdest = m2.groups()
-        return {"rdest":int(rdest), "immediate": int(immediate), "rs1":int(rs1)}
-
-    # opcode immediate, rd
-    re22 = re.compile(r"\w+[ ]+((?![rRfF]\d{1,2})\w+), [rRfF](\d{1,2})")
-    m22 = re22.search(instructionline)
-    if m22:
-        immediate, rdest = m22.groups()
-        return {"rdest":int(rdest), "immediate":immediate}
-    
-    # opcode rd, rs1
-    re3 = re.compile(r"^\w+[ ]+[rRfF](\d{1,2}), [rRfF](\d{1,2})$")
-    m3 = re3.search(instructionline)
-    if m3:
-        rdest, rs1 = m3.groups()
-        return {"rdest":int(rdest), "rs1":int(rs1)}
-
-    # opcode rd, rs1, rs2    
-    re4 = re.compile(r"\w+[ ]+[rRfF](\d{1,2}), [rRfF](\d{1,2}), [rRfF](\d{1,2})")
-    m4 = re4.search(instructionline)
-    if m4:
-        rdest, rs1, rs2 = m4.groups()
-        return {"rdest":int(rdest), "rs1":int(rs1), "rs2":int(rs2)}
-
-    # rd, rs1, immediate
-    re5 = re.compile(r"\w+[ ]+[rRfF](\d{1,2}), [rRfF](\d{1,2}), (\w+)")
-    m5 = re5.search(instructionline)
-    if m5:
-        rdest, rs1, immediate = m5.groups()
-        return {"rdest":int(rdest), "rs1":int(rs1), "immediate":immediate}
-
-    # opcode rd, immediate
-    re6 = re.compile(r"\w+[ ]+[rRfF](\d{1,2}), (\d+)")
-    m6 = re6.search(instructionline)
-    if m6:
-        rdest, immediate = m6.groups()
-        return {"rdest":int(rdest), "immediate":int(immediate)}
-
-    # opcode name
-    re7 = re.compile(r"\w+[ ]+((?![rRfF]\d{1,2})\w+)")
-    m7 = re7.search(instructionline)
-    if m7:
-        name, = m7.groups()
-        return {"name":name}
-
-    # opcode rs1
-    re8 = re.compile(r"\w+[ ]+[rRfF](\d{1,2})")
-    m8 = re8.search(instructionline)
-    if m8:
-        rs1, = m8.groups()
-        return {"rs1":int(rs1)}
-    
-    # opcode rs1, name
-    re9 = re.compile(r"[bB]\D*[ ]+[rRfF](\d{1,2}), ((?![rRfF]\d{1,2})\w+)")
-    m9 = re9.search(instructionline)
-    if m9:
-        rs1, name = m9.groups()
-        return {"rs1":int(rs1), "name":name}
-
-    return {}
+OPERANDS = {}
+def mapoperands():
+    """
+    Performs the mapping to initialize OPERANDS from the opcode tables.
+
+    The operand form of an opcode follows from its table and its opcode
+    number: loads and stores occupy 0x20-0x2f, branches and traps are the
+    special cases given by INSTRUCTIONS and every other I-type takes a
+    destination, an optional source and an immediate.
+    """
+    for mnemonic, opcode in I_OPCODES.items():
+        instrclass = INSTRUCTIONS.get(mnemonic)
+        if instrclass is instructions.Branch:
+            OPERANDS[mnemonic] = BRANCHOPERANDS
+        elif instrclass is instructions.Trap:
+            OPERANDS[mnemonic] = NAMEOPERANDS
+        elif 0x20 <= opcode < 0x28:
+            OPERANDS[mnemonic] = LOADOPERANDS
+        elif 0x28 <= opcode < 0x30:
+            OPERANDS[mnemonic] = STOREOPERANDS
+        else:
+            OPERANDS[mnemonic] = ITYPEOPERANDS
+    OPERANDS["jr"] = REGISTEROPERANDS
+    OPERANDS["jalr"] = REGISTEROPERANDS
+    for mnemonic in J_OPCODES:
+        OPERANDS[mnemonic] = NAMEOPERANDS
+    for mnemonic in R_OPCODES:
+        OPERANDS[mnemonic] = RTYPEOPERANDS
+    OPERANDS["nop"] = NOOPERANDS
+mapoperands()
+
+def parseimmediate(token):
+    """ Returns a numeric immediate as an int, leaving symbol names as is. """
+    if not token.lstrip("-")[0].isdigit():
+        return token
+    if "x" in token or "X" in token:
+        return int(token, 16)
+    return int(token)
+
+def parseoperands(opcodetoken, operandtext):
+    """ 
+    Parses the operand text of a line for its values. 
+
+    Most of the heavy (parse)lifting is done here. The opcode selects a single
+    precompiled grammar, so each line is matched exactly once. Returning named
+    values allows instructions to be dynamically created by principle of which
+    set of operands they require. 
+    """
+    match = OPERANDS[opcodetoken].match(operandtext)
+    if not match:
+        raise Exception("Invalid operands for {0}: '{1}'".format(
+            opcodetoken, operandtext.strip()))
+    operandvalues = {}
+    for key, value in match.groupdict().iteritems():
+        if value is None:
+            continue
+        if key == "immediate" or key == "name":
+            operandvalues[key] = parseimmediate(value)
+        else:
+            operandvalues[key] = int(value)
+    return operandvalues
@@ -0,0 +1,184 @@
+"""
+Segment Map
+===========
+
+Lays an assembled program out as a sparse map of the memory it fills. The map
+is a list of runs sorted by address, each either a block of bytes or a fill
+of one repeated byte, so memory nothing is assembled to takes no space at all
+and memory reserved by .space or .align takes a single run, whatever its size.
+
+Runs are merged as they are written whenever a run ends where the next one
+starts, so straight line code and data become one run per segment however
+the source is ordered. Writing to memory that already belongs to a run is an
+error, which catches .text and .data addresses that make segments overlap.
+
+The output lists the runs in address order, one record per line:
+
+    aaaaaaaa: hhhhhhhh          up to four bytes hhhhhhhh at address aaaaaaaa
+    aaaaaaaa: fill bb nnnnnnnn  nnnnnnnn bytes of value bb from aaaaaaaa
+
+Reserved memory is written as a zero fill, and so is any stretch of at least
+FILLTHRESHOLD equal bytes in whole words within a block, such as a table of
+zeros. All numbers are in hex.
+"""
+
+import os, re, bisect, binascii
+import dlxparser, instructions
+from dlximage import WORD
+
+# Shortest run of equal bytes within a block written as a fill record.
+FILLTHRESHOLD = 16
+
+FILLRUN = re.compile(r"(.)\1{" + str(FILLTHRESHOLD - 1) + r",}", re.DOTALL)
+
+def run(inputdata, basedir=os.curdir):
+    """ Assembles the program in inputdata and returns its segment records. """
+    assembler = dlxparser.Assembler(basedir)
+    instructionlist = assembler.resolveall(assembler.firstpass(inputdata))
+    segments = build(assembler, instructionlist)
+    return "\n".join(segments.records())
+
+def stream(infile, outfile, basedir=os.curdir):
+    """
+    Assembles the program in infile, writing its segment records to outfile.
+
+    As with Assembler.stream, the input is read once for the symbols and once
+    more to place each line as it is parsed. Only the segment map is held in
+    memory, and reserved memory takes none.
+    """
+    assembler = dlxparser.Assembler(basedir)
+    assembler.scanlines(infile)
+    infile.seek(0)
+    lineobjs = assembler.checksymbols(assembler.parselines(infile, False))
+    segments = build(assembler, lineobjs)
+    separator = ""
+    for record in segments.records():
+        outfile.write(separator + record)
+        separator = "\n"
+
+def build(assembler, instructionlist, curraddr=0):
+    """
+    Returns the SegmentMap of an iterable of line objects.
+
+    Symbols are resolved through assembler, which must be the Assembler that
+    parsed the line objects. The first object is placed at curraddr, which
+    is 0 for a whole program.
+    """
+    segments = SegmentMap()
+    for lineobj in instructionlist:
+        if isinstance(lineobj, instructions.Instruction):
+            word = assembler.encodeword(lineobj, curraddr)
+            segments.write(curraddr, WORD.pack(word))
+        else:
+            packed = lineobj.packblock()
+            if packed:
+                segments.write(curraddr, packed)
+            else:
+                segments.fill(curraddr, lineobj.reservedsize(curraddr))
+        curraddr = lineobj.nextaddress(curraddr)
+    return segments
+
+class SegmentMap(object):
+    """
+    Sparse memory, as runs sorted by address.
+
+    Run i covers the addresses from starts[i] up to ends[i]. Its contents are
+    a bytearray, or the int value of every byte if it is a fill.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.contents = []
+        self.last = -1 # Run written last, which the next write usually extends
+
+    def write(self, addr, data):
+        """ Writes a string of bytes at addr. """
+        if data:
+            self.insert(addr, addr + len(data), bytearray(data))
+
+    def fill(self, addr, length, value=0):
+        """ Fills length bytes from addr with value. """
+        if length > 0:
+            self.insert(addr, addr + length, value)
+
+    def insert(self, start, end, content):
+        """
+        Adds the run from start up to end, merging it with its neighbours.
+
+        Raises an exception if the run overlaps one already in the map.
+        """
+        starts, ends, contents = self.starts, self.ends, self.contents
+        last = self.last
+        if last >= 0 and ends[last] == start:
+            index = last + 1
+        else:
+            index = bisect.bisect_right(starts, start)
+            if index and ends[index - 1] > start:
+                raise Exception("Overlapping write at {0:#010x}".format(start))
+        if index < len(starts) and starts[index] < end:
+            raise Exception("Overlapping write at {0:#010x}".format(starts[index]))
+
+        if index and ends[index - 1] == start and mergeable(contents[index - 1],
+                                                            content):
+            index = index - 1
+            if type(content) is bytearray:
+                contents[index].extend(content)
+            ends[index] = end
+        else:
+            starts.insert(index, start)
+            ends.insert(index, end)
+            contents.insert(index, content)
+        nextindex = index + 1
+        if (nextindex < len(starts) and starts[nextindex] == end
+                and mergeable(contents[index], contents[nextindex])):
+            if type(content) is bytearray:
+                contents[index].extend(contents[nextindex])
+            ends[index] = ends[nextindex]
+            del starts[nextindex], ends[nextindex], contents[nextindex]
+        self.last = index
+
+    def runs(self):
+        """ Returns the list of (start, end, contents) of every run. """
+        return zip(self.starts, self.ends, self.contents)
+
+    def records(self):
+        """ Generates the output records of every run, in address order. """
+        for start, end, content in self.runs():
+            if type(content) is int:
+                yield fillrecord(start, end - start, content)
+                continue
+            data = str(content)
+            position = 0
+            for match in FILLRUN.finditer(data):
+                # Keep to whole words, so data records stay word aligned
+                fillstart = ((start + match.start() + 3) & ~3) - start
+                fillend = ((start + match.end()) & ~3) - start
+                if fillend - fillstart < FILLTHRESHOLD:
+                    continue
+                if fillstart > position:
+                    yield datarecords(start + position, data[position:fillstart])
+                yield fillrecord(start + fillstart, fillend - fillstart,
+                                 ord(match.group(1)))
+                position = fillend
+            if position < len(data):
+                yield datarecords(start + position, data[position:])
+
+def mergeable(content, following):
+    """ Tells whether the contents of two adjacent runs can form one run. """
+    if type(content) is bytearray:
+        return type(following) is bytearray
+    return type(following) is int and content == following
+
+def fillrecord(addr, length, value):
+    """ Returns the record of a fill. """
+    return "%08x: fill %02x %08x" % (addr, value, length)
+
+def datarecords(addr, data):
+    """ Returns the records of a block of bytes, four bytes to a line. """
+    hexdata = binascii.hexlify(data)
+    count = (len(hexdata) + 7) // 8
+    fields = [None] * (2 * count)
+    fields[0::2] = xrange(addr, addr + 4 * count, 4)
+    fields[1::2] = [hexdata[start:start + 8] for start in xrange(0, len(hexdata), 8)]
+    return ("%08x: %s\n" * count % tuple(fields))[:-1]
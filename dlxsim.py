@@ -0,0 +1,463 @@
+"""
+DLX Simulator
+=============
+
+Runs assembled programs in process, to check their results.
+
+The program is loaded as a memory image: a .bin image, a .hex listing or a
+.dlx program, which is assembled first. Execution starts at address 0 and
+ends at trap 0. Each word is decoded once, with the field layouts the encode
+methods in instructions use, into a handler and up to three arguments:
+registers, immediates already extended the way the instruction needs, and
+the absolute targets of branches and jumps. Decoded words are kept in basic
+blocks, each a run of straight line instructions ended by the first branch,
+jump or trap, keyed by the address they start at, so a loop is decoded once
+however often it runs. A store into memory a block was decoded from drops
+every block, and the block that made it goes on from the next instruction,
+decoded again, so code a program writes runs as written.
+
+Handlers come from a table by mnemonic. Each is a small function over the
+registers and memory of one Simulator, compiled once from the statement it
+executes, so running a block is one call per instruction and nothing else.
+
+Registers and memory hold unsigned 32 bit words. Floating point registers
+hold the bits of singles, and a double occupies an even register and the one
+after it, high word first, as in memory. mult, div, multu and divu work on
+integers in floating point registers, as in DLX. Overflow does not trap. An
+access outside memory, a division by zero, converting a NaN or an infinity
+to an integer, an invalid word or running past the step limit stops the
+simulation with an error. From the command line the limit is MAXSTEPS
+unless --max-steps gives another, or 0 for none, so a program that never
+reaches trap 0 still ends.
+
+Usage:
+    python dlxsim.py [--max-steps N] [--memory BYTES] [--registers]
+                     program.dlx|program.hex|program.bin
+"""
+
+import sys, os, time, struct, argparse, binascii
+import dlxparser, dlximage, dlxdisasm
+from instructions import I_OPCODES, J_OPCODES, R_OPCODES, R_FUNCCODES
+
+MASK = 0xffffffff
+
+# Smallest memory a program is given, in bytes.
+MEMORYSIZE = 1 << 20
+
+# Most instructions run from the command line by default.
+MAXSTEPS = 10000000
+
+# Most instructions decoded into one block.
+BLOCKLIMIT = 256
+
+# Blocks are tracked by pages of 2**PAGEBITS bytes for invalidation.
+PAGEBITS = 8
+
+WORD = struct.Struct(">I")
+PAIR = struct.Struct(">II")
+BYTE = struct.Struct(">b")
+UBYTE = struct.Struct(">B")
+HALF = struct.Struct(">h")
+UHALF = struct.Struct(">H")
+SINGLE = struct.Struct(">f")
+DOUBLE = struct.Struct(">d")
+
+# Results of the integer operations on the unsigned words x and y.
+OPERATIONS = {
+    "add": "(x + y) & 0xffffffff",
+    "addu": "(x + y) & 0xffffffff",
+    "sub": "(x - y) & 0xffffffff",
+    "subu": "(x - y) & 0xffffffff",
+    "and": "x & y",
+    "or": "x | y",
+    "xor": "x ^ y",
+    "sll": "(x << (y & 31)) & 0xffffffff",
+    "srl": "x >> (y & 31)",
+    "sra": "(((x ^ 0x80000000) - 0x80000000) >> (y & 31)) & 0xffffffff",
+    "seq": "int(x == y)",
+    "sne": "int(x != y)",
+    "slt": "int(x ^ 0x80000000 < y ^ 0x80000000)",
+    "sgt": "int(x ^ 0x80000000 > y ^ 0x80000000)",
+    "sle": "int(x ^ 0x80000000 <= y ^ 0x80000000)",
+    "sge": "int(x ^ 0x80000000 >= y ^ 0x80000000)",
+    "lhi": "y",
+}
+
+# Operation and immediate extension of every I-type arithmetic instruction.
+IMMEDIATES = {
+    "addi": ("add", "signed"), "addui": ("addu", "unsigned"),
+    "subi": ("sub", "signed"), "subui": ("subu", "unsigned"),
+    "andi": ("and", "unsigned"), "ori": ("or", "unsigned"),
+    "xori": ("xor", "unsigned"), "lhi": ("lhi", "high"),
+    "slli": ("sll", "unsigned"), "srli": ("srl", "unsigned"),
+    "srai": ("sra", "unsigned"),
+    "seqi": ("seq", "signed"), "snei": ("sne", "signed"),
+    "slti": ("slt", "signed"), "sgti": ("sgt", "signed"),
+    "slei": ("sle", "signed"), "sgei": ("sge", "signed"),
+}
+
+# Statements of the other instructions. R-types take the registers d, s and
+# t; loads and stores d, s and the offset k; branches the register s, the
+# target and the address that follows; jumps the target and that address.
+STATEMENTS = {
+    "addf": "fregs[d] = singlebits(single(fregs[s]) + single(fregs[t]))",
+    "subf": "fregs[d] = singlebits(single(fregs[s]) - single(fregs[t]))",
+    "multf": "fregs[d] = singlebits(single(fregs[s]) * single(fregs[t]))",
+    "divf": "fregs[d] = singlebits(single(fregs[s]) / single(fregs[t]))",
+    "addd": "setdouble(fregs, d, double(fregs, s) + double(fregs, t))",
+    "subd": "setdouble(fregs, d, double(fregs, s) - double(fregs, t))",
+    "multd": "setdouble(fregs, d, double(fregs, s) * double(fregs, t))",
+    "divd": "setdouble(fregs, d, double(fregs, s) / double(fregs, t))",
+    "cvtf2d": "setdouble(fregs, d, single(fregs[s]))",
+    "cvtf2i": "fregs[d] = int(single(fregs[s])) & 0xffffffff",
+    "cvtd2f": "fregs[d] = singlebits(double(fregs, s))",
+    "cvtd2i": "fregs[d] = int(double(fregs, s)) & 0xffffffff",
+    "cvti2f": "fregs[d] = singlebits(signed(fregs[s]))",
+    "cvti2d": "setdouble(fregs, d, signed(fregs[s]))",
+    "mult": "fregs[d] = (signed(fregs[s]) * signed(fregs[t])) & 0xffffffff",
+    "div": "fregs[d] = quotient(signed(fregs[s]), signed(fregs[t])) "
+           "& 0xffffffff",
+    "multu": "fregs[d] = (fregs[s] * fregs[t]) & 0xffffffff",
+    "divu": "fregs[d] = fregs[s] // fregs[t]",
+    "movf": "fregs[d] = fregs[s]",
+    "movd": "fregs[d] = fregs[s]; fregs[d + 1] = fregs[s + 1]",
+    "movfp2i": "regs[d] = fregs[s]",
+    "movi2fp": "fregs[d] = regs[s]",
+    "lb": "regs[d] = BYTE.unpack_from(memory, (regs[s] + k) & 0xffffffff)[0] "
+          "& 0xffffffff",
+    "lbu": "regs[d] = UBYTE.unpack_from(memory, (regs[s] + k) & 0xffffffff)[0]",
+    "lh": "regs[d] = HALF.unpack_from(memory, (regs[s] + k) & 0xffffffff)[0] "
+          "& 0xffffffff",
+    "lhu": "regs[d] = UHALF.unpack_from(memory, (regs[s] + k) & 0xffffffff)[0]",
+    "lw": "regs[d] = WORD.unpack_from(memory, (regs[s] + k) & 0xffffffff)[0]",
+    "lf": "fregs[d] = WORD.unpack_from(memory, (regs[s] + k) & 0xffffffff)[0]",
+    "ld": "fregs[d], fregs[d + 1] = PAIR.unpack_from(memory, "
+          "(regs[s] + k) & 0xffffffff)",
+    "sb": "store(UBYTE, 1, (regs[s] + k) & 0xffffffff, regs[d] & 0xff)",
+    "sh": "store(UHALF, 2, (regs[s] + k) & 0xffffffff, regs[d] & 0xffff)",
+    "sw": "store(WORD, 4, (regs[s] + k) & 0xffffffff, regs[d])",
+    "sf": "store(WORD, 4, (regs[s] + k) & 0xffffffff, fregs[d])",
+    "sd": "store(PAIR, 8, (regs[s] + k) & 0xffffffff, fregs[d], fregs[d + 1])",
+    "beqz": "return target if regs[s] == 0 else follow",
+    "bnez": "return target if regs[s] != 0 else follow",
+    "j": "return target",
+    "jal": "regs[31] = follow; return target",
+    "jr": "return regs[s]",
+    "jalr": "target = regs[s]; regs[31] = follow; return target",
+    "trap": "return machine.trap(s, follow)",
+}
+
+# Parameters of the handler of each kind of instruction.
+PARAMETERS = {
+    dlxparser.RTYPEOPERANDS: "d, s, t",
+    dlxparser.ITYPEOPERANDS: "d, s, y",
+    dlxparser.LOADOPERANDS: "d, s, k",
+    dlxparser.STOREOPERANDS: "d, s, k",
+    dlxparser.BRANCHOPERANDS: "s, target, follow",
+    dlxparser.REGISTEROPERANDS: "s, follow, unused",
+    dlxparser.NAMEOPERANDS: "target, follow, unused",
+}
+
+# Mnemonics of the instructions that end a block.
+TRANSFERS = frozenset(["beqz", "bnez", "j", "jal", "jr", "jalr", "trap"])
+
+def handlersource(mnemonic):
+    """ Returns the source of the statement the handler of mnemonic runs. """
+    if mnemonic in STATEMENTS:
+        return STATEMENTS[mnemonic]
+    if mnemonic in IMMEDIATES:
+        return "x = regs[s]; regs[d] = " + OPERATIONS[IMMEDIATES[mnemonic][0]]
+    return "x = regs[s]; y = regs[t]; regs[d] = " + OPERATIONS[mnemonic]
+
+def compilehandler(mnemonic):
+    """
+    Returns the factory of the handler of mnemonic.
+
+    The factory takes the state of a Simulator and returns the handler.
+    Instructions that set no register but r0 are dropped when decoded, so
+    handlers can write any register. nop has no handler.
+    """
+    if mnemonic == "nop":
+        return None
+    if mnemonic == "trap":
+        parameters = "s, follow, unused"
+    else:
+        parameters = PARAMETERS[dlxparser.OPERANDS[mnemonic]]
+    source = ("def make(regs, fregs, memory, store, machine):\n"
+              "    def handler({0}):\n"
+              "        {1}\n"
+              "    return handler\n").format(parameters, handlersource(mnemonic))
+    namespace = {}
+    code = compile(source, "<{0} handler>".format(mnemonic), "exec")
+    exec code in globals(), namespace
+    return namespace["make"]
+
+# Handler factories, by mnemonic.
+FACTORIES = dict((mnemonic, compilehandler(mnemonic)) for mnemonic in
+                 list(I_OPCODES) + list(J_OPCODES) + list(R_OPCODES))
+
+# Mnemonics by the key dlxdisasm.key gives their words.
+MNEMONICS = [None] * len(dlxdisasm.DECODE)
+
+def mapmnemonics():
+    """ Fills MNEMONICS by inverting the opcode tables. """
+    for mnemonic, opcode in I_OPCODES.items() + J_OPCODES.items():
+        MNEMONICS[opcode] = mnemonic
+    for mnemonic, opcode in R_OPCODES.items():
+        MNEMONICS[64 * (opcode + 1) + R_FUNCCODES[mnemonic]] = mnemonic
+mapmnemonics()
+
+# Mnemonics of the instructions whose only effect is setting regs[d].
+SETSREGISTER = frozenset(mnemonic for mnemonic in FACTORIES
+                         if mnemonic != "nop" and mnemonic not in TRANSFERS
+                         and handlersource(mnemonic).split("; ")[-1]
+                         .startswith("regs[d] ="))
+
+def decode(word, addr):
+    """
+    Returns the mnemonic and handler arguments of the word at addr.
+
+    Returns None if the word is not the encoding of any instruction.
+    """
+    index = dlxdisasm.key(word)
+    if word & dlxdisasm.ZEROMASKS[index]:
+        return None
+    mnemonic = MNEMONICS[index]
+    rs1 = (word >> 21) & 0x1f
+    field2 = (word >> 16) & 0x1f
+    follow = (addr + 4) & MASK
+    if index >= 64: # R-type: rd, rs1, rs2
+        return mnemonic, (word >> 11) & 0x1f, rs1, field2
+    immediate = word & 0xffff
+    signedimmediate = (immediate ^ 0x8000) - 0x8000
+    if mnemonic in J_OPCODES:
+        offset = ((word & 0x3ffffff) ^ 0x2000000) - 0x2000000
+        return mnemonic, (follow + offset) & MASK, follow, 0
+    if mnemonic in ("beqz", "bnez"):
+        return mnemonic, rs1, (follow + signedimmediate) & MASK, follow
+    if mnemonic in ("jr", "jalr"):
+        return mnemonic, rs1, follow, 0
+    if mnemonic == "trap":
+        return mnemonic, immediate, follow, 0
+    extension = IMMEDIATES.get(mnemonic, (None, "signed"))[1]
+    if extension == "signed":
+        immediate = signedimmediate & MASK
+    elif extension == "high":
+        immediate = immediate << 16
+    return mnemonic, field2, rs1, immediate
+
+def single(bits):
+    """ Returns the single a word holds. """
+    return SINGLE.unpack(WORD.pack(bits))[0]
+
+def singlebits(value):
+    """ Returns the word holding a value as a single. """
+    return WORD.unpack(SINGLE.pack(value))[0]
+
+def double(fregs, n):
+    """ Returns the double held by registers n and n + 1. """
+    return DOUBLE.unpack(PAIR.pack(fregs[n], fregs[n + 1]))[0]
+
+def setdouble(fregs, n, value):
+    """ Stores a double in registers n and n + 1. """
+    fregs[n], fregs[n + 1] = PAIR.unpack(DOUBLE.pack(value))
+
+def signed(word):
+    """ Returns the signed value of a word. """
+    return (word ^ 0x80000000) - 0x80000000
+
+def quotient(dividend, divisor):
+    """ Divides, rounding towards zero. """
+    result = abs(dividend) // abs(divisor)
+    return -result if (dividend < 0) != (divisor < 0) else result
+
+class CodeChanged(Exception):
+    """ Raised by a store that dropped the decoded blocks. """
+
+class Simulator(object):
+    """
+    A DLX machine: registers, memory and the blocks decoded from it.
+
+    traps maps trap numbers other than 0 to functions called with the
+    Simulator; trap 0 halts.
+    """
+
+    def __init__(self, image, memorysize=MEMORYSIZE):
+        self.memory = bytearray(max(memorysize, len(image)))
+        self.memory[:len(image)] = image
+        self.regs = [0] * 32
+        self.fregs = [0] * 32
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+        self.traps = {}
+        self.blocks = {}
+        self.codepages = set()
+        self.handlers = dict((mnemonic, factory(self.regs, self.fregs,
+                                                self.memory, self.store, self))
+                             for mnemonic, factory in FACTORIES.items()
+                             if factory is not None)
+
+    def run(self, maxsteps=None):
+        """
+        Runs from pc until trap 0. Returns the number of instructions run.
+
+        Raises an exception if more than maxsteps instructions would run.
+        """
+        blocks, decodeblock = self.blocks, self.decodeblock
+        pc = self.pc
+        steps = 0
+        try:
+            while pc is not None:
+                self.pc = pc
+                block = blocks.get(pc)
+                if block is None:
+                    block = decodeblock(pc)
+                body, (transfer, a, b, c), count, addresses = block
+                if maxsteps is not None and steps + count > maxsteps:
+                    raise Exception("Step limit of {0} reached at {1:#010x}"
+                                    .format(maxsteps, pc))
+                remaining = iter(body)
+                try:
+                    for handler, x, y, z in remaining:
+                        handler(x, y, z)
+                except CodeChanged:
+                    # The rest of the block may have been overwritten
+                    addr = addresses[len(body) - len(list(remaining)) - 1]
+                    steps = steps + (addr - pc) // 4 + 1
+                    pc = addr + 4
+                    continue
+                steps = steps + count
+                pc = transfer(a, b, c)
+        except (struct.error, ZeroDivisionError, OverflowError, ValueError,
+                IndexError), exc:
+            raise Exception("{0} in the block at {1:#010x}".format(exc, pc))
+        finally:
+            self.steps = self.steps + steps
+        return steps
+
+    def decodeblock(self, pc):
+        """ Decodes and keeps the block starting at pc. """
+        handlers, memory = self.handlers, self.memory
+        body = []
+        addresses = [] # Of the instruction of each handler in body
+        addr = pc
+        count = 0
+        while True:
+            if addr & 3 or addr + 4 > len(memory):
+                transfer = (self.fault, addr, "PC outside memory", 0)
+                break
+            decoded = decode(WORD.unpack_from(memory, addr)[0], addr)
+            if decoded is None:
+                transfer = (self.fault, addr, "Invalid instruction", 0)
+                break
+            mnemonic, a, b, c = decoded
+            addr = addr + 4
+            count = count + 1
+            if mnemonic in TRANSFERS:
+                transfer = (handlers[mnemonic], a, b, c)
+                break
+            if mnemonic != "nop" and not (mnemonic in SETSREGISTER and a == 0):
+                body.append((handlers[mnemonic], a, b, c))
+                addresses.append(addr - 4)
+            if count == BLOCKLIMIT:
+                transfer = (self.follow, addr, 0, 0)
+                break
+        self.codepages.update(xrange(pc >> PAGEBITS, ((addr - 1) >> PAGEBITS) + 1))
+        block = (body, transfer, count, addresses)
+        self.blocks[pc] = block
+        return block
+
+    def follow(self, addr, unused, unusedtoo):
+        """ Ends a block cut at BLOCKLIMIT: execution goes on at addr. """
+        return addr
+
+    def fault(self, addr, message, unused):
+        """ Ends a block at a word that cannot run. """
+        raise Exception("{0} at {1:#010x}".format(message, addr))
+
+    def trap(self, number, follow):
+        """ Runs a trap. Returns where execution goes on, None to halt. """
+        if number == 0:
+            self.halted = True
+            self.pc = follow
+            return None
+        if number not in self.traps:
+            raise Exception("Unknown trap {0}".format(number))
+        self.traps[number](self)
+        return follow
+
+    def store(self, packer, size, addr, *values):
+        """
+        Stores values at addr, dropping the blocks if it overwrites code.
+
+        Raises CodeChanged once the blocks are dropped, so that Simulator.run
+        decodes the rest of the running block again.
+        """
+        packer.pack_into(self.memory, addr, *values)
+        codepages = self.codepages
+        if addr >> PAGEBITS in codepages or (addr + size - 1) >> PAGEBITS in codepages:
+            self.blocks.clear()
+            codepages.clear()
+            raise CodeChanged()
+
+def load(path, basedir=None):
+    """ Returns the memory image of a .bin, .hex or .dlx file. """
+    extension = os.path.splitext(path)[1]
+    if extension == ".bin":
+        with open(path, "rb") as infile:
+            return bytearray(infile.read())
+    with open(path, "r") as infile:
+        inputdata = infile.read()
+    if extension == ".dlx":
+        return dlximage.run(inputdata, basedir or os.path.dirname(path)
+                            or os.curdir)
+    image = bytearray()
+    for addr, hexdigits in dlxdisasm.readhex(inputdata):
+        data = binascii.unhexlify(hexdigits)
+        if len(image) < addr + len(data):
+            image.extend(bytearray(addr + len(data) - len(image)))
+        image[addr:addr + len(data)] = data
+    return image
+
+def parseargs(argv):
+    """ Parses command line arguments. """
+    parser = argparse.ArgumentParser(description="Simulates DLX programs.")
+    parser.add_argument("inputfile", help="a .dlx program, .hex listing or "
+        ".bin image")
+    parser.add_argument("--max-steps", type=int, default=MAXSTEPS,
+        metavar="N", help="stop with an error after N instructions "
+            "(default: {0}, 0 for no limit)".format(MAXSTEPS))
+    parser.add_argument("--memory", type=int, default=MEMORYSIZE,
+        metavar="BYTES", help="size of memory (default: {0}, or the image "
+            "if larger)".format(MEMORYSIZE))
+    parser.add_argument("--registers", action="store_true",
+        help="print the registers that are not zero when the program halts")
+    return parser.parse_args(argv)
+
+def main():
+    """ Main function. Runs the program and reports how fast it ran. """
+    args = parseargs(sys.argv[1:])
+    try:
+        simulator = Simulator(load(args.inputfile), args.memory)
+    except (IOError, ValueError), exc:
+        sys.exit(str(exc))
+    except Exception, exc:
+        sys.exit("assembly failed: {0}".format(exc))
+    start = time.time()
+    try:
+        simulator.run(args.max_steps or None)
+    except Exception, exc:
+        sys.exit("simulation failed: {0}".format(exc))
+    elapsed = time.time() - start
+    print "halted at {0:#010x} after {1} instructions in {2:.3f} s " \
+        "({3:.0f} instructions/s)".format(simulator.pc, simulator.steps,
+            elapsed, simulator.steps / max(elapsed, 1e-9))
+    if args.registers:
+        for prefix, registers in (("r", simulator.regs), ("f", simulator.fregs)):
+            for number, value in enumerate(registers):
+                if value:
+                    print "{0}{1:<2} {2:#010x}".format(prefix, number, value)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Assembly Statistics
+===================
+
+Profiles a single assembly for the --stats flag of dlxas. The result is a
+dictionary ready to be written as JSON, holding:
+
+    - the wall time of reading the input, the first pass, the second pass
+      and writing the output
+    - the number of instructions of each class and of directives of each type
+    - the operand grammars lines were matched against, and how often each
+      matched
+    - the size of the symbol table and the number of symbol lookups
+    - the peak memory of the process
+
+The plain assembler is never slowed down for this. Lookups are counted by a
+subclass of Assembler, and everything else is counted from the line objects
+and the input after the passes have been timed, so counting does not add to
+the times either.
+"""
+
+import os, sys, time, resource
+import dlxparser, dlximage, dlxsegments
+from instructions import OPCODES
+from directives import DIRECTIVES
+
+# Names of the operand grammars, by grammar.
+GRAMMARS = dict((getattr(dlxparser, name), name) for name in dir(dlxparser)
+                if name.endswith("OPERANDS") and name != "OPERANDS")
+
+# Names of the directives, by class.
+DIRECTIVENAMES = dict((directiveclass, name) for name, directiveclass in
+                      DIRECTIVES.items())
+
+class ProfilingAssembler(dlxparser.Assembler):
+    """ An Assembler that counts its symbol lookups, single or batched. """
+
+    def __init__(self, basedir=os.curdir):
+        super(ProfilingAssembler, self).__init__(basedir)
+        self.lookups = 0
+
+    def lookup(self, symbol):
+        """ Returns the value of a symbol, counting the lookup. """
+        self.lookups = self.lookups + 1
+        return super(ProfilingAssembler, self).lookup(symbol)
+
+    def resolvefixups(self, table):
+        """ Resolves a fixup table, counting a lookup for every entry. """
+        self.lookups = self.lookups + len(table)
+        return super(ProfilingAssembler, self).resolvefixups(table)
+
+def assemble(inputfile, outputpath, outputformat="hex", vector=False,
+             basedir=os.curdir):
+    """
+    Assembles inputfile to outputpath, returning statistics of the assembly.
+
+    The output is the same as dlxas would write. Binary images are always
+    built in memory here, whatever their size, so that placing them and
+    writing them can be timed apart. Included files are found in basedir.
+    """
+    if vector:
+        import dlxvector
+    assembler = ProfilingAssembler(basedir)
+    start = time.time()
+    with open(inputfile, "r") as infile:
+        inputdata = infile.read()
+    afterread = time.time()
+    instructionlist = assembler.firstpass(inputdata)
+    afterfirstpass = time.time()
+    if outputformat == "bin":
+        outputdata = bytearray(dlximage.imagesize(instructionlist))
+        placer = dlxvector.place if vector else dlximage.place
+        placer(assembler, assembler.resolveall(instructionlist), outputdata)
+    elif outputformat == "seg":
+        segments = dlxsegments.build(assembler,
+                                     assembler.resolveall(instructionlist))
+        outputdata = "\n".join(segments.records())
+    elif vector:
+        outputdata = dlxvector.encodetext(assembler,
+                                          assembler.resolveall(instructionlist))
+    else:
+        outputdata = assembler.secondpass(instructionlist)
+    aftersecondpass = time.time()
+    with open(outputpath, "wb" if outputformat == "bin" else "w") as outfile:
+        outfile.write(outputdata)
+    end = time.time()
+
+    stats = {
+        "file": inputfile,
+        "times": {
+            "read": afterread - start,
+            "firstpass": afterfirstpass - afterread,
+            "secondpass": aftersecondpass - afterfirstpass,
+            "write": end - aftersecondpass,
+        },
+        "symbols": {
+            "defined": len(assembler.symtab),
+            "lookups": assembler.lookups,
+        },
+        "peakmemory": peakmemory(),
+    }
+    stats.update(countlines(instructionlist))
+    stats["operands"] = countgrammars(inputdata.splitlines(), basedir)
+    return stats
+
+def countlines(instructionlist):
+    """ Counts the instructions by class and the directives by type. """
+    classes, directives = {}, {}
+    for lineobj in instructionlist:
+        directive = DIRECTIVENAMES.get(type(lineobj))
+        if directive is not None:
+            directives[directive] = directives.get(directive, 0) + 1
+        else:
+            name = type(lineobj).__name__
+            classes[name] = classes.get(name, 0) + 1
+    return {"instructions": classes, "directives": directives}
+
+def countgrammars(lines, directory=os.curdir):
+    """
+    Counts the operand grammars instruction lines are matched against.
+
+    Each opcode selects a single grammar from dlxparser.OPERANDS, so every
+    instruction line tries exactly one pattern, and it matches; a line it
+    does not match fails the first pass. The lines of included files are
+    counted wherever they are included, the files being found relative to 
+    directory as the assembler finds them.
+    """
+    matched = {}
+    matchgrammars(lines, directory, matched)
+    return {"lines": sum(matched.values()), "matched": matched}
+
+def matchgrammars(lines, directory, matched):
+    """ Adds the grammar of every instruction line to matched, by name. """
+    for line in lines:
+        splitted = dlxparser.splitline(line)
+        if splitted is None:
+            continue
+        label, token1, operands = splitted
+        if token1 == ".include":
+            path = dlxparser.linehandler(token1, operands).path()
+            path = os.path.realpath(os.path.join(directory, path))
+            with open(path, "r") as includefile:
+                matchgrammars(includefile, os.path.dirname(path), matched)
+        elif token1 in OPCODES:
+            name = GRAMMARS[dlxparser.OPERANDS[token1]]
+            matched[name] = matched.get(name, 0) + 1
+
+def peakmemory():
+    """ Returns the peak resident memory of this process in bytes. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak = peak * 1024 # Kilobytes everywhere else
+    return peak
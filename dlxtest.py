@@ -0,0 +1,114 @@
+"""
+Equivalence Tests
+=================
+
+Checks that every way dlxas can assemble a program gives the same result.
+
+A program is generated by dlxgen and assembled by dlxas as a user would run
+it, plainly and then with --stream, --vector and --parallel, alone and
+combined where dlxas allows it, for each output format they apply to. Every
+output must be identical to the plain one. The program is then given
+references to undefined symbols near its start and its end, and each way
+must fail with the same error, naming both.
+
+The program is long enough for --parallel to cut it into several chunks,
+so the chunks really are parsed and encoded apart. Ways that use --vector
+are skipped if NumPy is not installed.
+
+Usage:
+    python dlxtest.py [lines] [seed]
+"""
+
+import sys, os, shutil, subprocess, tempfile
+import dlxgen, dlxvector
+
+# Lines of the generated program, enough for several --parallel chunks.
+NUMLINES = 60000
+
+# Flags of every way to assemble, by output format. The first is plain.
+VARIANTS = [
+    ("hex", [[], ["--stream"], ["--vector"], ["--stream", "--vector"],
+             ["--parallel", "-j", "2"]]),
+    ("bin", [[], ["--stream"], ["--vector"], ["--stream", "--vector"]]),
+    ("seg", [[], ["--stream"]]),
+]
+
+# The assembler, run from wherever this script is.
+DLXAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dlxas.py")
+
+def assemble(inputfile, outputformat, flags):
+    """
+    Runs dlxas on inputfile. Returns its output, or the error it failed with.
+
+    The error is the last line dlxas wrote to standard error.
+    """
+    outputpath = os.path.splitext(inputfile)[0] + "." + outputformat
+    command = [sys.executable, DLXAS, "--format", outputformat] + flags
+    process = subprocess.Popen(command + [inputfile], stderr=subprocess.PIPE)
+    errors = process.communicate()[1]
+    if process.returncode != 0:
+        return None, errors.strip().splitlines()[-1]
+    with open(outputpath, "rb") as outputfile:
+        outputdata = outputfile.read()
+    os.remove(outputpath)
+    return outputdata, None
+
+def compare(inputfile, expectfailure=False):
+    """
+    Assembles inputfile every way, comparing each result to the plain one.
+
+    Returns the number of ways whose result differs.
+    """
+    failures = 0
+    for outputformat, variants in VARIANTS:
+        expected = None
+        for flags in variants:
+            if "--vector" in flags and not dlxvector.AVAILABLE:
+                print "skipped {0} {1}: no NumPy".format(outputformat,
+                                                        " ".join(flags))
+                continue
+            result = assemble(inputfile, outputformat, flags)
+            name = " ".join([outputformat] + flags)
+            if expected is None:
+                expected = result
+                if (result[1] is not None) != expectfailure:
+                    print "FAIL {0}: {1}".format(name, result[1] or
+                                                 "assembled without error")
+                    failures = failures + 1
+                continue
+            if result == expected:
+                print "ok   {0}".format(name)
+            elif result[1] is not None or expected[1] is not None:
+                print "FAIL {0}: {1!r} where plain gives {2!r}".format(
+                    name, result[1], expected[1])
+                failures = failures + 1
+            else:
+                print "FAIL {0}: output differs from plain {1}".format(
+                    name, outputformat)
+                failures = failures + 1
+    return failures
+
+def main():
+    """ Main function. Runs the tests, exiting non-zero if any failed. """
+    numlines = int(sys.argv[1]) if len(sys.argv) > 1 else NUMLINES
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    lines = list(dlxgen.generate(numlines, seed))
+    directory = tempfile.mkdtemp(prefix="dlxtest")
+    try:
+        inputfile = os.path.join(directory, "program.dlx")
+        with open(inputfile, "w") as program:
+            program.write("\n".join(lines) + "\n")
+        failures = compare(inputfile)
+        lines[1:1] = ["j undefinednearstart"]
+        lines.append("beqz r1,undefinednearend")
+        with open(inputfile, "w") as program:
+            program.write("\n".join(lines) + "\n")
+        failures = failures + compare(inputfile, True)
+    finally:
+        shutil.rmtree(directory)
+    if failures:
+        sys.exit("{0} ways differ from plain assembly".format(failures))
+    print "all ways agree"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Vectorized Encoder
+==================
+
+An optional second pass that encodes instructions in bulk with NumPy.
+
+Line objects are taken in blocks. For every instruction in a block, its
+format, opcode, registers, immediate, function code and address are gathered
+into arrays, with symbols already looked up. All words of the block are then
+computed at once with shifts and masks, PC relative offsets of branches and
+jumps included, and turned into hex text or image bytes in bulk as well.
+The formulas are those of the encode methods in instructions, so the result
+is bit for bit the same as the scalar second pass.
+
+Directives and any instruction type without a formula here are still encoded
+one by one by the Assembler, in their place in the output. If NumPy is not
+installed, AVAILABLE is False and none of this can be used.
+"""
+
+import os
+import dlxparser, dlximage, instructions
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+AVAILABLE = numpy is not None
+
+# Number of line objects encoded as one block.
+BLOCKSIZE = 1 << 16
+
+# Instruction formats, each with its own formula.
+ITYPE, BRANCH, JUMP, RTYPE = range(4)
+FORMATS = {
+    instructions.IType: ITYPE,
+    instructions.Trap: ITYPE,
+    instructions.Branch: BRANCH,
+    instructions.JType: JUMP,
+    instructions.RALU: RTYPE,
+    instructions.RFPU: RTYPE,
+}
+
+if AVAILABLE:
+    HEXDIGITS = numpy.frombuffer(b"0123456789abcdef", dtype=numpy.uint8)
+    NIBBLESHIFTS = numpy.arange(28, -4, -4, dtype=numpy.int64)
+    BYTEOFFSETS = numpy.arange(4, dtype=numpy.int64)
+
+def run(inputdata, basedir=os.curdir):
+    """ Assembles the program in inputdata and returns the output. """
+    assembler = dlxparser.Assembler(basedir)
+    instructionlist = assembler.resolveall(assembler.firstpass(inputdata))
+    return encodetext(assembler, instructionlist)
+
+def stream(infile, outfile, basedir=os.curdir):
+    """ Streams infile to outfile like Assembler.stream, encoding in bulk. """
+    assembler = dlxparser.Assembler(basedir)
+    assembler.scanlines(infile)
+    infile.seek(0)
+    separator = ""
+    curraddr = 0
+    lineobjs = assembler.checksymbols(assembler.parselines(infile, False))
+    for block in blocks(lineobjs):
+        text, curraddr = encodeblocktext(assembler, block, curraddr)
+        if text:
+            outfile.write(separator + text)
+            separator = "\n"
+
+def streamimage(infile, path, basedir=os.curdir):
+    """ Assembles infile straight to an image file, placing in bulk. """
+    assembler = dlxparser.Assembler(basedir)
+    size = assembler.scanlines(infile)
+    infile.seek(0)
+    lineobjs = assembler.checksymbols(assembler.parselines(infile, False))
+    dlximage.write(assembler, lineobjs, size, path, place)
+
+def blocks(lineobjs):
+    """ Generates lists of up to BLOCKSIZE line objects from an iterable. """
+    block = []
+    for lineobj in lineobjs:
+        block.append(lineobj)
+        if len(block) == BLOCKSIZE:
+            yield block
+            block = []
+    if block:
+        yield block
+
+def encodetext(assembler, instructionlist):
+    """ Returns the output for line objects, like Assembler.secondpass. """
+    pieces = []
+    curraddr = 0
+    for block in blocks(instructionlist):
+        text, curraddr = encodeblocktext(assembler, block, curraddr)
+        if text:
+            pieces.append(text)
+    return "\n".join(pieces)
+
+def place(assembler, instructionlist, image):
+    """ Writes line objects into image, like dlximage.place. """
+    curraddr = 0
+    for block in blocks(instructionlist):
+        curraddr = placeblock(assembler, block, image, curraddr)
+
+def gather(assembler, block, curraddr):
+    """
+    Collects the fields of every instruction in a block placed at curraddr.
+
+    Returns the field arrays, the pieces of the block in order and the
+    address after the block. A piece is either the number of consecutive
+    instructions it covers in the arrays, or a tuple of a line object that
+    has to be encoded on its own and its address.
+    """
+    formats, opcodes, rs1s, rs2s, rdests, immediates, funcs, addresses = (
+        [], [], [], [], [], [], [], [])
+    pieces = []
+    count = 0
+    lookup = assembler.lookup
+    for lineobj in block:
+        form = FORMATS.get(type(lineobj))
+        if form is None:
+            if count:
+                pieces.append(count)
+                count = 0
+            pieces.append((lineobj, curraddr))
+            curraddr = lineobj.nextaddress(curraddr)
+            continue
+        if form == JUMP:
+            immediate = lineobj.name
+            rs1 = rs2 = rdest = func = 0
+        elif form == RTYPE:
+            immediate = 0
+            rs1, rs2, rdest, func = (lineobj.rs1, lineobj.rs2, lineobj.rdest,
+                                     lineobj.func)
+        else:
+            immediate = lineobj.immediate
+            rs1, rdest = lineobj.rs1, lineobj.rdest
+            rs2 = func = 0
+        if type(immediate) is str:
+            immediate = lookup(immediate)
+        formats.append(form)
+        opcodes.append(lineobj.opcode)
+        rs1s.append(rs1)
+        rs2s.append(rs2)
+        rdests.append(rdest)
+        immediates.append(immediate)
+        funcs.append(func)
+        addresses.append(curraddr)
+        count = count + 1
+        curraddr = curraddr + 4
+    if count:
+        pieces.append(count)
+    fields = [numpy.array(column, dtype=numpy.int64) for column in
+              (formats, opcodes, rs1s, rs2s, rdests, immediates, funcs,
+               addresses)]
+    return fields, pieces, curraddr
+
+def computewords(fields):
+    """
+    Computes the word of every instruction from its gathered fields.
+
+    Returns None if a word does not fit in 32 bits, which only happens for
+    out of range operands; those blocks are left to the scalar encoder.
+    """
+    form, opcode, rs1, rs2, rdest, immediate, func, address = fields
+    itype = ((((opcode << 5) ^ rs1) << 5) ^ rdest) << 16
+    relative = immediate - (address + 4)
+    rtype = (((((opcode << 5) + rs1) << 5) + rs2) << 5) + rdest
+    words = numpy.select(
+        [form == ITYPE, form == BRANCH, form == JUMP],
+        [itype ^ (immediate & 0xffff), itype ^ (relative & 0xffff),
+         (opcode << 26) ^ (relative & 0x3ffffff)],
+        (rtype << 11) + func)
+    if len(words) and (words.min() < 0 or words.max() > 0xffffffff
+                       or address.max() > 0xffffffff):
+        return None
+    return words
+
+def hexrows(addresses, words):
+    """ Returns the lines 'address: word' for arrays of both, as one string. """
+    rows = numpy.empty((len(words), 19), dtype=numpy.uint8)
+    rows[:, 0:8] = HEXDIGITS[(addresses[:, None] >> NIBBLESHIFTS) & 0xf]
+    rows[:, 8] = ord(":")
+    rows[:, 9] = ord(" ")
+    rows[:, 10:18] = HEXDIGITS[(words[:, None] >> NIBBLESHIFTS) & 0xf]
+    rows[:, 18] = ord("\n")
+    return rows.tostring()
+
+def encodeblocktext(assembler, block, curraddr):
+    """ Returns the output of a block placed at curraddr, and its end. """
+    fields, pieces, endaddr = gather(assembler, block, curraddr)
+    words = computewords(fields)
+    if words is None:
+        text = "\n".join(assembler.encodelines(block, curraddr))
+        return text, endaddr
+    addresses = fields[-1]
+    chunks = []
+    start = 0
+    for piece in pieces:
+        if type(piece) is int:
+            end = start + piece
+            chunks.append(hexrows(addresses[start:end], words[start:end]))
+            start = end
+        else:
+            lineobj, addr = piece
+            lines = "\n".join(assembler.encodelines((lineobj,), addr))
+            if lines:
+                chunks.append(lines + "\n")
+    return "".join(chunks)[:-1], endaddr
+
+def placeblock(assembler, block, image, curraddr):
+    """ Writes a block placed at curraddr into image. Returns its end. """
+    fields, pieces, endaddr = gather(assembler, block, curraddr)
+    words = computewords(fields)
+    if words is None:
+        dlximage.place(assembler, block, image, curraddr)
+        return endaddr
+    imagebytes = numpy.frombuffer(image, dtype=numpy.uint8)
+    wordbytes = words.astype(">u4").view(numpy.uint8).reshape(-1, 4)
+    addresses = fields[-1]
+    start = 0
+    for piece in pieces:
+        if type(piece) is int:
+            end = start + piece
+            targets = addresses[start:end, None] + BYTEOFFSETS
+            imagebytes[targets] = wordbytes[start:end]
+            start = end
+        else:
+            lineobj, addr = piece
+            dlximage.place(assembler, (lineobj,), image, addr)
+    return endaddr
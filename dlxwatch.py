@@ -0,0 +1,121 @@
+"""
+Watch Mode
+==========
+
+Keeps the .hex output of a program up to date while it is edited, for the
+--watch flag of dlxas.
+
+The program and every file it includes are polled every POLLINTERVAL seconds.
+A file counts as changed when its inode, size or modification time does, so
+editors that save by writing a new file and renaming it over the old one are
+followed as well as ones that write in place. Once a change is seen, the
+files must stay the same for DEBOUNCE seconds before the program is
+assembled again, so a burst of saves leads to a single rebuild. While the
+program itself is missing, e.g. between the two steps of such a save, the
+rebuild waits for it to reappear.
+
+Rebuilds are kept cheap by reusing the state of the previous one: programs
+without includes are assembled by an IncrementalAssembler, which only redoes
+the lines an edit affected, and included files are only parsed again when
+their contents change (see dlxparser.INCLUDES). Output is written to a
+temporary file and renamed into place, so readers never see half of it.
+Each rebuild reports the time it took, or the error it failed with.
+"""
+
+import sys, os, time, tempfile
+import dlxparser, dlxcache
+from dlxincremental import IncrementalAssembler
+
+# Seconds between polls of the watched files.
+POLLINTERVAL = 0.01
+
+# Seconds the files must stay unchanged before a rebuild.
+DEBOUNCE = 0.03
+
+def watch(inputfile, outputpath, basedir=os.curdir, report=sys.stdout):
+    """ Assembles inputfile to outputpath every time it changes. Never returns. """
+    watcher = Watcher(inputfile, outputpath, basedir)
+    while True:
+        report.write(watcher.build() + "\n")
+        report.flush()
+        watcher.wait()
+
+class Watcher(object):
+    """
+    Rebuilds the output of a program when it or the files it includes change.
+    """
+
+    def __init__(self, inputfile, outputpath, basedir=os.curdir):
+        self.inputfile = inputfile
+        self.outputpath = outputpath
+        self.basedir = basedir
+        self.assembler = IncrementalAssembler()
+        self.paths = [inputfile]
+        self.signatures = {}
+
+    def build(self):
+        """ Assembles the program again. Returns the line to report. """
+        start = time.time()
+        # Taken before reading, so a save during the rebuild causes another
+        self.signatures = self.current()
+        try:
+            with open(self.inputfile, "r") as infile:
+                inputdata = infile.read()
+            included = []
+            try:
+                if ".include" in inputdata: # Spares scanning every line for one
+                    dlxcache.includes(self.inputfile, included)
+            finally:
+                # Includes that failed to open are watched for their return
+                self.paths = [self.inputfile] + included
+                for path in included:
+                    if path not in self.signatures:
+                        self.signatures[path] = signature(path)
+            if included:
+                outputdata = dlxparser.run(inputdata, self.basedir)
+            else:
+                outputdata = self.assembler.update(inputdata)
+            writeatomically(self.outputpath, outputdata)
+        except Exception, exc:
+            return "{0}: {1}".format(self.inputfile, exc)
+        return "{0}: assembled in {1:.1f} ms".format(
+            self.outputpath, (time.time() - start) * 1000)
+
+    def current(self):
+        """ Returns the signature of every watched file, by path. """
+        return dict((path, signature(path)) for path in self.paths)
+
+    def wait(self):
+        """ Returns once the watched files changed and settled. """
+        current = self.current()
+        while current == self.signatures:
+            time.sleep(POLLINTERVAL)
+            current = self.current()
+        settled = time.time()
+        while (time.time() - settled < DEBOUNCE
+                or current[self.inputfile] is None):
+            time.sleep(POLLINTERVAL)
+            latest = self.current()
+            if latest != current:
+                current = latest
+                settled = time.time()
+
+def signature(path):
+    """ Returns what tells whether the file at path changed, or None. """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+def writeatomically(path, outputdata):
+    """ Writes outputdata to a temporary file and renames it to path. """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temppath = tempfile.mkstemp(dir=directory, prefix=".tmp")
+    try:
+        with os.fdopen(handle, "w") as outfile:
+            outfile.write(outputdata)
+        os.rename(temppath, path)
+    except:
+        dlxcache.removequietly(temppath)
+        raise
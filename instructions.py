@@ -9,10 +9,12 @@ This module:
 3) Contains a constant mapping for certain opcode mnemonics to their respective
         types. Some special cases are required when instruction keyword 
         parameters are named differently.
-4) At startup time, reads opcode mnemonics from file. 
+4) At startup time, loads opcode mnemonics from the tables beside this module,
+        using a compiled form of them that is kept up to date automatically
+        in the user's cache directory.
 """
 
-import sys
+import sys, os, marshal
 
 I_OPCODES = {}
 J_OPCODES = {}
@@ -21,27 +23,104 @@ R_FUNCCODES = {}
 OPCODES = {}
 INSTRUCTIONS = {} 
 
+# The opcode tables live next to this module, wherever it is run from.
+TABLEDIR = os.path.dirname(os.path.abspath(__file__))
+TABLEFILES = tuple(os.path.join(TABLEDIR, name) 
+                   for name in ("Itypes", "Jtypes", "Rtypes"))
+# The compiled form of the tables, rebuilt whenever a text table changes. It
+# is kept out of TABLEDIR, which need not be writable once installed.
+COMPILEDDIR = os.path.join(os.path.expanduser("~"), ".cache", "dlxas-opcodes")
+COMPILEDTABLES = os.path.join(COMPILEDDIR, "opcodes.marshal")
+
 def loadopcodes():
-    """ Loads opcodes from file into their respective mappings. """
+    """ 
+    Loads opcodes into their respective mappings. 
+
+    The text tables are only parsed when their compiled form is missing or 
+    was compiled from different versions of them; the compiled form is then
+    written again. Otherwise loading costs a stat of each text table and 
+    one read of the compiled form.
+    """
     try:
-        with open("Itypes", "r") as itypes:
-            for line in itypes:
-                split = line.split()
-                I_OPCODES[split[0]] = int(split[1])
-                OPCODES[split[0]] = int(split[1])
-        with open("Jtypes", "r") as jtypes:
-            for line in jtypes:
-                split = line.split()
-                J_OPCODES[split[0]] = int(split[1])
-                OPCODES[split[0]] = int(split[1])
-        with open("Rtypes", "r") as rtypes:
-            for line in rtypes:
-                split = line.split()
-                R_OPCODES[split[0]] = int(split[1])
-                R_FUNCCODES[split[0]] = int(split[2])
-                OPCODES[split[0]] = int(split[1])
-    except IOError, exc:
+        signature = tablessignature()
+        tables = loadcompiled(signature)
+        if tables is None:
+            tables = parsetables()
+            savecompiled(signature, tables)
+    except (IOError, OSError), exc:
         sys.exit(str(exc))
+    mappings = (I_OPCODES, J_OPCODES, R_OPCODES, R_FUNCCODES, OPCODES)
+    for mapping, table in zip(mappings, tables):
+        mapping.update(table)
+
+def tablessignature():
+    """ 
+    Returns what identifies the text tables: their directory, sizes and 
+    mtimes. 
+    """
+    signature = [tuple(sys.version_info[:2]), TABLEDIR]
+    for path in TABLEFILES:
+        stat = os.stat(path)
+        signature.append((stat.st_size, stat.st_mtime))
+    return signature
+
+def parsetables():
+    """ Reads the opcode tables from their text files. """
+    itypespath, jtypespath, rtypespath = TABLEFILES
+    itypes, jtypes, rtypes, funccodes, opcodes = {}, {}, {}, {}, {}
+    with open(itypespath, "r") as itable:
+        for line in itable:
+            split = line.split()
+            itypes[split[0]] = int(split[1])
+            opcodes[split[0]] = int(split[1])
+    with open(jtypespath, "r") as jtable:
+        for line in jtable:
+            split = line.split()
+            jtypes[split[0]] = int(split[1])
+            opcodes[split[0]] = int(split[1])
+    with open(rtypespath, "r") as rtable:
+        for line in rtable:
+            split = line.split()
+            rtypes[split[0]] = int(split[1])
+            funccodes[split[0]] = int(split[2])
+            opcodes[split[0]] = int(split[1])
+    return itypes, jtypes, rtypes, funccodes, opcodes
+
+def loadcompiled(signature):
+    """ Returns the compiled tables if they match signature, else None. """
+    try:
+        with open(COMPILEDTABLES, "rb") as compiled:
+            storedsignature, tables = marshal.load(compiled)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if storedsignature != signature:
+        return None
+    return tables
+
+def savecompiled(signature, tables):
+    """ 
+    Writes the compiled tables, if the cache directory can be written to.
+
+    The file is renamed into place so that a concurrent start never reads
+    a partial file.
+    """
+    import tempfile # Only needed here, and slow to import
+    try:
+        if not os.path.isdir(COMPILEDDIR):
+            os.makedirs(COMPILEDDIR)
+        handle, temppath = tempfile.mkstemp(dir=COMPILEDDIR, prefix=".opcodes")
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(handle, "wb") as compiled:
+            marshal.dump((signature, tables), compiled)
+        os.chmod(temppath, 0o644)
+        os.rename(temppath, COMPILEDTABLES)
+    except (IOError, OSError):
+        try:
+            os.remove(temppath)
+        except OSError:
+            pass
 loadopcodes()
 
 class Instruction(object):
@@ -50,8 +129,14 @@ class Instruction(object):
 
     Provides common initialization functionality. Also provides common
     functionality for incrementing the address during assembly. 
+    Instructions and their subtypes declare their fields in __slots__, so 
+    that a program of millions of lines does not carry an instance 
+    dictionary for each of them. Subtypes must declare __slots__ as well, 
+    even if empty.
     """
 
+    __slots__ = ("opcode",)
+
     def __init__(self, opcode):
         self.opcode = opcode
 
@@ -70,31 +155,40 @@ class IType(Instruction):
     is provided. 
     """
 
+    __slots__ = ("rs1", "rdest", "immediate")
+
     def __init__(self, opcode, rs1=0, rdest=0, immediate=0):
         super(IType, self).__init__(opcode)
         self.rs1 = rs1
         self.rdest = rdest
         self.immediate = immediate
 
+    def resolved(self, value):
+        """ Returns a copy of the instruction with value as its immediate. """
+        instruction = object.__new__(type(self))
+        instruction.opcode = self.opcode
+        instruction.rs1 = self.rs1
+        instruction.rdest = self.rdest
+        instruction.immediate = value
+        return instruction
+
     def encode(self):
+        """ Returns the hex representation of the instruction as a string. """
+        return "{0:08x}".format(self.encodeword())
+
+    def encodeword(self):
         """
         Encodes an I-type instruction. 
         
-        Builds an instruction from instance variables, and returns it in a hex
-        representation. If the immediate value is a label, it's value is 
-        retrieved from the symbol table. 
+        Builds an instruction from instance variables, and returns it as an
+        integer. If the immediate value was a label, the assembler has already 
+        replaced it with its value from the symbol table. 
         """
-        if type(self.immediate) is str:
-            if self.immediate.isdigit():
-                self.immediate = int(self.immediate)
-            else:
-                from dlxparser import SYMTAB
-                self.immediate = SYMTAB[self.immediate]
         instruction = self.opcode
         instruction = (instruction << 5) ^ self.rs1
         instruction = (instruction << 5) ^ self.rdest
         instruction = (instruction << 16) ^ (self.immediate & 0xffff)
-        return "{0:08x}".format(instruction)
+        return instruction
 
 class Branch(IType):
     """
@@ -104,6 +198,8 @@ class Branch(IType):
     so that the correct offset can be calculated. 
     """
 
+    __slots__ = ()
+
     def __init__(self, opcode, rs1=0, rdest=0, immediate=0):
         super(IType, self).__init__(opcode)
         self.rs1 = rdest
@@ -111,25 +207,23 @@ class Branch(IType):
         self.immediate = immediate
 
     def encode(self, curraddr):
+        """ Returns the hex representation of the instruction as a string. """
+        return "{0:08x}".format(self.encodeword(curraddr))
+
+    def encodeword(self, curraddr):
         """ 
-        Encodes the branch instruction. 
+        Encodes the branch instruction as an integer. 
 
         Branch instruction is encoded relative to the current address. If the 
-        branch target is a label, it's value is retrieved from the symbol table.
-        Otherwise an immediate value is used.
+        branch target was a label, the assembler has already replaced it with 
+        its value from the symbol table.
         """
-        if type(self.immediate) is str:
-            if self.immediate.isdigit():
-                self.immediate = int(self.immediate)
-            else:
-                from dlxparser import SYMTAB
-                self.immediate = SYMTAB[self.immediate]
         relativeaddr = self.immediate - (curraddr + 4)
         instruction = self.opcode
         instruction = (instruction << 5) ^ self.rs1
         instruction = (instruction << 5) ^ self.rdest
         instruction = (instruction << 16) ^ (relativeaddr & 0xffff)
-        return "{0:08x}".format(instruction)
+        return instruction
 
 class Trap(IType):
     """
@@ -139,6 +233,8 @@ class Trap(IType):
     simply parsing. 
     """
 
+    __slots__ = ()
+
     def __init__(self, opcode, name=0):
         super(Trap, self).__init__(opcode)
         self.immediate = name    
@@ -152,28 +248,35 @@ class JType(Instruction):
     address must be passed in for encoding.    
     """
 
+    __slots__ = ("name",)
+
     def __init__(self, opcode, name=0):
         super(JType, self).__init__(opcode)
         self.name = name
 
+    def resolved(self, value):
+        """ Returns a copy of the instruction with value as its target. """
+        instruction = object.__new__(type(self))
+        instruction.opcode = self.opcode
+        instruction.name = value
+        return instruction
+
     def encode(self, curraddr):
+        """ Returns the hex representation of the instruction as a string. """
+        return "{0:08x}".format(self.encodeword(curraddr))
+
+    def encodeword(self, curraddr):
         """ 
-        Encodes the jump instruction. 
+        Encodes the jump instruction as an integer. 
 
         Jump instruction is encoded relative to the current address. If the 
-        jump target is a label, it's value is retrieved from the symbol table.
-        Otherwise an immediate value is used.
+        jump target was a label, the assembler has already replaced it with 
+        its value from the symbol table.
         """
-        if type(self.name) is str:
-            if self.name.isdigit():
-                self.name = int(self.name)
-            else:
-                from dlxparser import SYMTAB
-                self.name = SYMTAB[self.name]
         relativeaddr = self.name - (curraddr + 4)
         instruction = self.opcode
         instruction = (instruction << 26) ^ (relativeaddr & 0x3ffffff)
-        return "{0:08x}".format(instruction)
+        return instruction
 
 class RType(Instruction):
     """ 
@@ -184,6 +287,8 @@ class RType(Instruction):
     register.    
     """
 
+    __slots__ = ("rs1", "rs2", "rdest", "func")
+
     def __init__(self, opcode, func, rs1=0, rs2=0, rdest=0):
         super(RType, self).__init__(opcode)
         self.rs1 = rs1
@@ -191,6 +296,10 @@ class RType(Instruction):
         self.rdest = rdest
         self.func = func
 
+    def encode(self):
+        """ Returns the hex representation of the instruction as a string. """
+        return "{0:08x}".format(self.encodeword())
+
 class RALU(RType):
     """ 
     A more specific R-type instruction class. 
@@ -198,15 +307,17 @@ class RALU(RType):
     Provides the specific encoding functionality required by R-ALU instructions.
     """
 
-    def encode(self):
-        """ Returns the hex representation of the instruction as a string. """
+    __slots__ = ()
+
+    def encodeword(self):
+        """ Returns the encoding of the instruction as an integer. """
         instruction = self.opcode
         instruction = (instruction << 5) + self.rs1
         instruction = (instruction << 5) + self.rs2
         instruction = (instruction << 5) + self.rdest
         instruction = (instruction << 5)
         instruction = (instruction << 6) + self.func
-        return "{0:08x}".format(instruction)
+        return instruction
     
 class RFPU(RType):
     """ 
@@ -215,22 +326,22 @@ class RFPU(RType):
     Provides the specific encoding functionality required by R-FLU instructions.
     """
 
-    def encode(self):
-        """ Returns the hex representation of the instruction as a string. """
+    __slots__ = ()
+
+    def encodeword(self):
+        """ Returns the encoding of the instruction as an integer. """
         instruction = self.opcode
         instruction = (instruction << 5) + self.rs1
         instruction = (instruction << 5) + self.rs2
         instruction = (instruction << 5) + self.rdest
         instruction = (instruction << 6)
         instruction = (instruction << 5) + self.func
-        return "{0:08x}".format(instruction)
+        return instruction
 
 def needsPC(instructionojb):
     """ Returns whether a given instruction requires PC to be encoded. """
-    needs = [JType, Branch]
-    if type(instructionojb) in needs:
-        return True
-    return False
+    instructiontype = type(instructionojb)
+    return instructiontype is JType or instructiontype is Branch
 
 def mapinstructions():
     """ Performs the mapping to initialize INSTRUCTIONS. """